@@ -0,0 +1,359 @@
+import gzip
+import hashlib
+from flask import Blueprint, abort, jsonify, request, url_for
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import HTTPException
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Venue, Artist, Show
+from queries import PROFILE_SHOWS_LIMIT, decode_cursor, encode_cursor, show_timeline
+from search import search_catalog
+from geosearch import nearby_params, nearby_venues
+from facets import facet_filters, apply_facets, facet_counts
+from importer import validate, missing_references
+from scheduling import AVAILABILITY_MAX_SLOTS, availability, show_conflicts, parse_month, month_calendar, calendar_tags
+from exporter import json_value
+from cache import page_cache
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+#----------------------------------------------------------------------------#
+# JSON API, v1.
+#----------------------------------------------------------------------------#
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+# bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 512
+
+# kind: (model, form, {form field: column}, fields returned without fields=)
+RESOURCES = {
+  'venues': (
+    Venue, VenueForm, {'website_link': 'website'},
+    ('id', 'name', 'city', 'state', 'upcoming_shows_count')
+  ),
+  'artists': (
+    Artist, ArtistForm, {'website_link': 'website'},
+    ('id', 'name', 'city', 'state', 'upcoming_shows_count')
+  ),
+}
+
+# show fields and what each one needs joined in
+SHOW_FIELDS = {
+  'id': (Show.id, None),
+  'venue_id': (Show.venue_id, None),
+  'artist_id': (Show.artist_id, None),
+  'start_time': (Show.start_time, None),
+  'venue_name': (Venue.name.label('venue_name'), Venue),
+  'venue_image_link': (Venue.image_link.label('venue_image_link'), Venue),
+  'artist_name': (Artist.name.label('artist_name'), Artist),
+  'artist_image_link': (Artist.image_link.label('artist_image_link'), Artist),
+}
+DEFAULT_SHOW_FIELDS = ('id', 'venue_id', 'artist_id', 'start_time')
+
+
+def requested_fields(allowed, default):
+  # ?fields=name,city -- the id is always returned, unknown names are a 400
+  fields = request.args.get('fields')
+  if not fields:
+    return list(default)
+
+  names = ['id'] + [name for name in fields.split(',') if name and name != 'id']
+  unknown = [name for name in names if name not in allowed]
+  if unknown:
+    abort(400, f'Unknown fields: {", ".join(unknown)}.')
+
+  return list(dict.fromkeys(names))
+
+
+def page_size():
+  per_page = request.args.get('limit', API_PAGE_SIZE, type=int)
+  return min(max(per_page, 1), API_MAX_PAGE_SIZE)
+
+
+def serialize(row, fields):
+  return {name: json_value(value) for name, value in zip(fields, row)}
+
+
+def page(rows, fields, per_page, cursor):
+  # rows hold one extra entry when there is a next page
+  next_cursor = cursor(rows[per_page - 1]) if len(rows) > per_page else None
+  return jsonify(
+    data=[serialize(row, fields) for row in rows[:per_page]],
+    next_cursor=next_cursor
+  )
+
+
+def resource(kind):
+  if kind not in RESOURCES:
+    abort(404)
+  return RESOURCES[kind]
+
+
+#  Responses
+#  ----------------------------------------------------------------
+
+@api.errorhandler(HTTPException)
+def http_error(error):
+  return jsonify(error=error.name, message=error.description), error.code
+
+
+def json_body():
+  # only application/json: a text/plain body is a simple cross-site request
+  # that skips the CORS preflight, and the API has no CSRF token
+  if not request.is_json:
+    abort(415, 'Send the body as application/json.')
+  return request.get_json(silent=True)
+
+
+@api.after_request
+def conditional_and_compressed(response):
+  # the ETag is taken from the uncompressed body and carries the encoding,
+  # so each representation validates separately
+  if request.method != 'GET' or response.status_code != 200 or response.direct_passthrough:
+    return response
+
+  body = response.get_data()
+  encoding = None
+  if len(body) >= COMPRESS_MIN_BYTES:
+    if brotli is not None and 'br' in request.accept_encodings:
+      encoding = 'br'
+    elif 'gzip' in request.accept_encodings:
+      encoding = 'gzip'
+
+  digest = hashlib.md5(body).hexdigest()
+  response.set_etag(f'{digest}-{encoding}' if encoding else digest)
+  response.vary.add('Accept-Encoding')
+  response.make_conditional(request)
+
+  if encoding and response.status_code == 200:
+    response.set_data(brotli.compress(body) if encoding == 'br' else gzip.compress(body))
+    response.headers['Content-Encoding'] = encoding
+
+  return response
+
+
+#  Venues and artists
+#  ----------------------------------------------------------------
+
+@api.route('/<kind>')
+def list_resources(kind):
+  # keyset pagination on id: ?after=<next_cursor>, narrowed by the facet
+  # filters: ?genre=Jazz&genre=Blues&state=CA&city=...&seeking=true
+  model, _, _, default = resource(kind)
+  fields = requested_fields(model.__table__.columns.keys(), default)
+  per_page = page_size()
+
+  stmt = select(*(model.__table__.c[name] for name in fields)).order_by(model.id).limit(per_page + 1)
+  stmt = apply_facets(stmt, model, facet_filters(request.args))
+  after = request.args.get('after', type=int)
+  if after is not None:
+    stmt = stmt.where(model.id > after)
+
+  rows = db.session.execute(stmt).all()
+  return page(rows, fields, per_page, lambda row: row.id)
+
+
+@api.route('/<kind>/<int:id>')
+def get_resource(kind, id):
+  # ?include=shows adds the past and upcoming shows, PROFILE_SHOWS_LIMIT per side
+  model, _, _, default = resource(kind)
+  fields = requested_fields(model.__table__.columns.keys(), default)
+
+  row = db.session.execute(
+    select(*(model.__table__.c[name] for name in fields)).where(model.id == id)
+  ).first()
+  if row is None:
+    abort(404)
+
+  data = serialize(row, fields)
+
+  if 'shows' in request.args.get('include', '').split(','):
+    timeline = show_timeline(id, kind[:-1], PROFILE_SHOWS_LIMIT, PROFILE_SHOWS_LIMIT)
+    for side in ('past_shows', 'upcoming_shows'):
+      timeline[side] = [
+        {name: json_value(value) for name, value in show.items()} for show in timeline[side]
+      ]
+    data.update(timeline)
+
+  return jsonify(data=data)
+
+
+@api.route('/<kind>/<int:id>/calendar')
+@page_cache.cached()
+def resource_calendar(kind, id):
+  # ?month=YYYY-MM: per day, the booked minutes, free stretches and shows
+  model = resource(kind)[0]
+  month = parse_month(request.args.get('month'))
+  if month is None:
+    abort(400, 'month must look like YYYY-MM, between 1900 and 2999.')
+  if db.session.get(model, id) is None:
+    abort(404)
+
+  owner = kind[:-1]
+  calendar = month_calendar(owner, id, month)
+  page_cache.tag(*calendar_tags(owner, id, calendar))
+
+  return jsonify(data={
+    'month': month.strftime('%Y-%m'),
+    'days': [{
+      'date': day['date'].isoformat(),
+      'booked_minutes': day['booked_minutes'],
+      'free': [{'start_time': json_value(start), 'end_time': json_value(end)} for start, end in day['free']],
+      'shows': [{name: json_value(value) for name, value in show.items()} for show in day['shows']],
+    } for day in calendar['days']],
+  })
+
+
+@api.route('/venues/near')
+def venues_near():
+  # ?near=94103|City, ST or ?lat=..&lon=.., optional radius_km and limit;
+  # nearest first
+  try:
+    latitude, longitude, radius_km, limit = nearby_params(request.args)
+  except ValueError as e:
+    abort(400, str(e))
+
+  results = nearby_venues(latitude, longitude, radius_km, limit)
+  return jsonify(
+    count=len(results),
+    data=[dict(venue._asdict(), distance_km=round(distance, 3)) for venue, distance in results]
+  )
+
+
+@api.route('/<kind>/search')
+def search_resources(kind):
+  model = resource(kind)[0]
+  term = request.args.get('q', '').strip()
+  if not term:
+    abort(400, 'The q parameter is required.')
+
+  results = search_catalog(model, term, page_size(), facet_filters(request.args))
+  return jsonify(count=results['count'], data=[hit._asdict() for hit in results['data']])
+
+
+@api.route('/<kind>/facets')
+def resource_facets(kind):
+  # value counts of every facet over the listing the same filters select
+  model = resource(kind)[0]
+  counts = facet_counts(model, facet_filters(request.args))
+
+  return jsonify(data={
+    facet: [{'value': value, 'count': count} for value, count in values] for facet, values in counts.items()
+  })
+
+
+@api.route('/<kind>', methods=['POST'])
+def create_resource(kind):
+  model, form_class, mapping, _ = resource(kind)
+  values, errors = validate(form_class, mapping, json_body() or {})
+  if errors:
+    return jsonify(error='Bad Request', errors=errors), 400
+
+  instance = model(**values)
+  db.session.add(instance)
+  try:
+    db.session.commit()
+  except IntegrityError as e:
+    db.session.rollback()
+    return jsonify(error='Conflict', message=str(e.orig)), 409
+  page_cache.invalidate(kind)
+
+  response = jsonify(data={'id': instance.id})
+  response.headers['Location'] = url_for('api.get_resource', kind=kind, id=instance.id)
+  return response, 201
+
+
+#  Shows
+#  ----------------------------------------------------------------
+
+@api.route('/shows')
+def list_shows():
+  # same (start_time, id) keyset as the HTML feed; venues and artists are
+  # only joined when one of their fields is requested
+  fields = requested_fields(SHOW_FIELDS, DEFAULT_SHOW_FIELDS)
+  per_page = page_size()
+
+  stmt = (
+    select(*(SHOW_FIELDS[name][0] for name in fields))
+    .add_columns(Show.start_time.label('cursor_time'), Show.id.label('cursor_id'))
+    .order_by(Show.start_time, Show.id)
+    .limit(per_page + 1)
+  )
+  for joined in dict.fromkeys(SHOW_FIELDS[name][1] for name in fields):
+    if joined is not None:
+      stmt = stmt.join(joined, joined.id == getattr(Show, joined.__tablename__[:-1] + '_id'))
+
+  after = decode_cursor(request.args.get('after'))
+  if after is not None:
+    stmt = stmt.where(tuple_(Show.start_time, Show.id) > tuple_(*after))
+
+  rows = db.session.execute(stmt).all()
+  return page(rows, fields, per_page, lambda row: encode_cursor(row.cursor_time, row.cursor_id))
+
+
+@api.route('/shows', methods=['POST'])
+def create_show():
+  values, errors = validate(ShowForm, {}, json_body() or {})
+  if errors:
+    return jsonify(error='Bad Request', errors=errors), 400
+
+  missing_venues, missing_artists = missing_references([values])
+  if missing_venues or missing_artists:
+    errors = {}
+    if missing_venues:
+      errors['venue_id'] = ['No such venue.']
+    if missing_artists:
+      errors['artist_id'] = ['No such artist.']
+    return jsonify(error='Bad Request', errors=errors), 400
+
+  conflicts = show_conflicts(values['venue_id'], values['artist_id'], values['start_time'], values['end_time'])
+  if conflicts:
+    return jsonify(error='Conflict', conflicts=[json_conflict(c) for c in conflicts]), 409
+
+  show = Show(**values)
+  db.session.add(show)
+  try:
+    db.session.commit()
+  except IntegrityError:
+    # booked by a concurrent request since the check; the exclusion
+    # constraints have the last word
+    db.session.rollback()
+    return jsonify(error='Conflict', conflicts=[]), 409
+  page_cache.invalidate('shows', 'venues', f'venue:{show.venue_id}', f'artist:{show.artist_id}')
+
+  return jsonify(data={'id': show.id}), 201
+
+
+@api.route('/shows/availability', methods=['POST'])
+def check_availability():
+  # {"slots": [{"venue_id", "artist_id", "start_time", "end_time"?}, ...]},
+  # answered in one query. returns one {available, conflicts} per slot.
+  slots = (json_body() or {}).get('slots')
+  if not isinstance(slots, list) or not slots:
+    abort(400, 'A non-empty slots list is required.')
+  if len(slots) > AVAILABILITY_MAX_SLOTS:
+    abort(400, f'At most {AVAILABILITY_MAX_SLOTS} slots per request.')
+
+  candidates, errors = [], {}
+  for i, slot in enumerate(slots):
+    values, slot_errors = validate(ShowForm, {}, slot if isinstance(slot, dict) else {})
+    if slot_errors:
+      errors[i] = slot_errors
+    candidates.append(values)
+  if errors:
+    return jsonify(error='Bad Request', errors=errors), 400
+
+  return jsonify(data=[
+    {'available': result['available'], 'conflicts': [json_conflict(c) for c in result['conflicts']]}
+    for result in availability(candidates)
+  ])
+
+
+def json_conflict(conflict):
+  return {name: json_value(value) for name, value in conflict.items()}
@@ -4,24 +4,57 @@
 
 import sys
 import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, stream_with_context, jsonify, abort
+from flask_wtf.csrf import validate_csrf
+from wtforms.validators import ValidationError
 from flask_moment import Moment
 from flask_migrate import Migrate
 import logging
 from logging import Formatter, FileHandler
+from config import load_config
 from forms import *
 from models import *
+from queries import *
+from facets import facet_filters, facet_counts
+from search import search_catalog
+from geosearch import nearby_params, nearby_venues
+from scheduling import with_end_time, show_conflicts, describe_conflict, parse_month, month_calendar, calendar_tags
+from instrumentation import init_metrics, metrics
+from cache import page_cache
+from formatting import format_datetime
+from fanout import fan_out
+from templating import init_templates
+from commands import (
+  rollover_shows_command, check_show_counters_command,
+  check_indexes_command, check_query_budget_command, check_replicas_command, cache_server_command,
+  import_command, export_command, warm_templates_command, geocode_venues_command
+)
+from importer import ENTITIES as IMPORT_ENTITIES, import_stream
+from exporter import EXPORTS, MIMETYPES, export_chunks
+from api import api
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
 app = Flask(__name__)
 moment = Moment(app)
-app.config.from_object('config')
-db.init_app(app)
+load_config(app)
+configure_db(app)
 migrate = Migrate(app, db)
+init_metrics(app)
+metrics.add_collector(pool_metrics)
+page_cache.init_app(app)
+app.cli.add_command(rollover_shows_command)
+app.cli.add_command(check_show_counters_command)
+app.cli.add_command(check_indexes_command)
+app.cli.add_command(check_query_budget_command)
+app.cli.add_command(check_replicas_command)
+app.cli.add_command(cache_server_command)
+app.cli.add_command(import_command)
+app.cli.add_command(export_command)
+app.cli.add_command(warm_templates_command)
+app.cli.add_command(geocode_venues_command)
+app.register_blueprint(api)
 
 # DONE: connect to a local postgresql database
 
@@ -30,70 +63,25 @@ migrate = Migrate(app, db)
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  if isinstance(value, str):
-    date = dateutil.parser.parse(value)
-  else:
-    date = value
-  
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
-
 app.jinja_env.filters['datetime'] = format_datetime
 
+# after the filters, since it may compile every template right away
+init_templates(app)
 
-def handle_form_errors(errors):
-  for field, message in errors.items():
-    flash(field + ' - ' + str(message), 'danger')
-
-
-def get_upcoming_shows(id, search):
-  if search == 'venue':
-    upcoming_shows_query = db.session.query(Show).join(Venue).filter(Show.venue_id == id).filter(Show.start_time > datetime.now()).all()
-
-  if search == 'artist':
-    upcoming_shows_query = db.session.query(Show).join(Artist).filter(Show.artist_id == id).filter(Show.start_time > datetime.now()).all()
 
-  upcoming_shows = []
+def stream_template(template_name, **context):
+  # renders the template chunk by chunk so the first bytes leave the server
+  # before the whole page has been built
+  app.update_template_context(context)
+  template = app.jinja_env.get_template(template_name)
+  stream = template.stream(context)
+  stream.enable_buffering(5)
+  return Response(stream_with_context(stream))
 
-  for show in upcoming_shows_query:
-    upcoming_shows.append({
-      'venue_id': show.venues.id,
-      'venue_name': show.venues.name,
-      'venue_image_link': show.venues.image_link,
-      'artist_id': show.artists.id,
-      'artist_name': show.artists.name,
-      'artist_image_link': show.artists.image_link,
-      'start_time': format_datetime(show.start_time)
-    })
 
-  return upcoming_shows
-
-
-def get_past_shows(id, search):
-  if search == 'venue':
-    past_shows_query = db.session.query(Show).join(Venue).filter(Show.venue_id == id).filter(Show.start_time < datetime.now()).all()
-
-  if search == 'artist':
-    past_shows_query = db.session.query(Show).join(Artist).filter(Show.artist_id == id).filter(Show.start_time < datetime.now()).all()
-
-  past_shows = []
-
-  for show in past_shows_query:
-    past_shows.append({
-      'venue_id': show.venues.id,
-      'venue_name': show.venues.name,
-      'venue_image_link': show.venues.image_link,
-      'artist_id': show.artists.id,
-      'artist_name': show.artists.name,
-      'artist_image_link': show.artists.image_link,
-      'start_time': format_datetime(show.start_time)
-    })
-
-  return past_shows
+def handle_form_errors(errors):
+  for field, message in errors.items():
+    flash(field + ' - ' + str(message), 'danger')
 
 #----------------------------------------------------------------------------#
 # Controllers.
@@ -108,73 +96,59 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@page_cache.cached('venues')
 def venues():
   # DONE: replace with real venues data.
   # num_upcoming_shows should be aggregated based on number of upcoming shows per venue.
-  data = []
-  res = Venue.query.all()
-  venues = [x.__dict__ for x in res]
-
-  for venue in venues:
-    if venue['state'] in [v['state'] for v in data]:
-      add_venue = {
-        'id': venue['id'],
-        'name': venue['name'],
-        'num_upcoming_shows': len(get_upcoming_shows(venue['id'], 'venue'))
-      }
-
-      for idx, x in enumerate(data):
-        if x['state'] == venue['state']:
-          data[idx]['venues'].append(add_venue)
-      
-    else:
-      add_state = {
-        'city': venue['city'],
-        'state': venue['state'],
-        'venues': [{
-          'id': venue['id'],
-          'name': venue['name'],
-          'num_upcoming_shows': len(get_upcoming_shows(venue['id'], 'venue'))
-        }]
-      }
-      data.append(add_state)
-
-  return render_template('pages/venues.html', areas=data)
+  page = request.args.get('page', 1, type=int)
+  filters = facet_filters(request.args)
+  results = fan_out({
+    'directory': lambda: venue_directory(max(page, 1), filters=filters),
+    'facets': lambda: facet_counts(Venue, filters)
+  }, optional=('facets',))
+
+  return render_template('pages/venues.html', filters=filters, facets=results['facets'], **results['directory'])
+
+@app.route('/venues/near')
+def venues_near():
+  # ?near=94103 (or 'City, ST') or ?lat=..&lon=.., optional radius_km and limit
+  if not request.args:
+    return render_template('pages/venues_near.html', results=None, error=None)
+  try:
+    latitude, longitude, radius_km, limit = nearby_params(request.args)
+  except ValueError as e:
+    return render_template('pages/venues_near.html', results=None, error=str(e)), 400
+
+  results = nearby_venues(latitude, longitude, radius_km, limit)
+  return render_template('pages/venues_near.html', results=results, error=None)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
   # DONE: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  response = {}
-  data = []
   search_term = request.form.get('search_term', '')
-
-  res = Venue.query.filter(
-    Venue.name.ilike(f'%{search_term}%') |
-    Venue.city.ilike(f'%{search_term}%') |
-    Venue.state.ilike(f'%{search_term}%')
-  ).all()
-
-  venues = [x.__dict__ for x in res]
-
-  for venue in venues:
-    data.append({
-      'id': venue['id'],
-      'name': venue['name'],
-      'num_upcoming_shows': len(get_upcoming_shows(venue['id'], 'venue')) 
-    })
-
-  response['count'], response['data'] = len(data), data
+  response = search_catalog(Venue, search_term, filters=facet_filters(request.args))
 
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 @app.route('/venues/<int:venue_id>')
+@page_cache.cached('venue:{venue_id}')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # DONE: replace with real venue data from the venues table, using venue_id
-  venue = Venue.query.get(venue_id)
-  
+  results = fan_out({
+    'venue': lambda: db.session.get(Venue, venue_id),
+    'timeline': lambda: show_timeline(
+      venue_id, 'venue',
+      past_limit=PROFILE_SHOWS_LIMIT,
+      upcoming_limit=PROFILE_SHOWS_LIMIT
+    )
+  })
+  venue = results['venue']
+  if venue is None:
+    abort(404)
+
   data = {
     'id': venue.id,
     'name': venue.name,
@@ -188,12 +162,11 @@ def show_venue(venue_id):
     'seeking_talent': venue.seeking_talent,
     'seeking_description': venue.seeking_description,
     'image_link': venue.image_link,
-    'past_shows': get_past_shows(venue.id, 'venue'),
-    'upcoming_shows': get_upcoming_shows(venue.id, 'venue'),
-    'past_shows_count': len(get_past_shows(venue.id, 'venue')),
-    'upcoming_shows_count': len(get_upcoming_shows(venue.id, 'venue'))
+    **results['timeline']
   }
 
+  page_cache.tag(*{f"artist:{show['artist_id']}" for show in data['past_shows'] + data['upcoming_shows']})
+
   return render_template('pages/show_venue.html', venue=data)
 
 #  Create Venue
@@ -228,6 +201,7 @@ def create_venue_submission():
 
       db.session.add(venue)
       db.session.commit()
+      page_cache.invalidate('venues')
       flash('Venue ' + request.form['name'] + ' was successfully listed!')
 
     except:
@@ -254,9 +228,11 @@ def delete_venue(venue_id):
   # DONE: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   try:
-    venue = Venue.query.get(venue_id)
+    # the delete cascades to shows, so load them up front in one query
+    venue = Venue.query.options(db.selectinload(Venue.shows)).get(venue_id)
     db.session.delete(venue)
     db.session.commit()
+    page_cache.invalidate('venues', f'venue:{venue_id}', 'shows')
     flash('Venue ' + venue.name + ' was successfully deleted!')
   except:
     db.session.rollback()
@@ -271,61 +247,48 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@page_cache.cached('artists')
 def artists():
   # DONE: replace with real data returned from querying the database
-  data = []
-  res = Artist.query.all()
-  artists = [x.__dict__ for x in res]
-
-  for artist in artists:
-    add_artist = {
-      'id': artist['id'],
-      'name': artist['name']
-    }
-    data.append(add_artist)
+  filters = facet_filters(request.args)
+  results = fan_out({
+    'artists': lambda: artist_directory(filters),
+    'facets': lambda: facet_counts(Artist, filters)
+  }, optional=('facets',))
 
-  return render_template('pages/artists.html', artists=data)
+  return render_template('pages/artists.html', artists=results['artists'], filters=filters, facets=results['facets'])
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
   # DONE: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
-  response = {}
-  data = []
   search_term = request.form.get('search_term', '')
-
-  res = Artist.query.filter(
-    Artist.name.ilike(f'%{search_term}%') |
-    Artist.city.ilike(f'%{search_term}%') |
-    Artist.state.ilike(f'%{search_term}%')
-  ).all()
-
-  artists = [x.__dict__ for x in res]
-
-  for artist in artists:
-    data.append({
-      'id': artist['id'],
-      'name': artist['name'],
-      'num_upcoming_shows': len(get_upcoming_shows(artist['id'], 'artist')) 
-    })
-
-  response['count'], response['data'] = len(data), data
+  response = search_catalog(Artist, search_term, filters=facet_filters(request.args))
 
   return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
+@page_cache.cached('artist:{artist_id}')
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
   # DONE: replace with real artist data from the artist table, using artist_id
-  artist = Artist.query.get(artist_id)
+  results = fan_out({
+    'artist': lambda: db.session.get(Artist, artist_id),
+    'timeline': lambda: show_timeline(
+      artist_id, 'artist',
+      past_limit=PROFILE_SHOWS_LIMIT,
+      upcoming_limit=PROFILE_SHOWS_LIMIT
+    )
+  })
+  artist = results['artist']
+  if artist is None:
+    abort(404)
 
-  genres = ''.join([str(i) for i in artist.genres])[1:-1].split(',')
-  
   data = {
     'id': artist.id,
     'name': artist.name,
-    'genres': genres,
+    'genres': artist.genres,
     'city': artist.city,
     'state': artist.state,
     'phone': artist.phone,
@@ -334,21 +297,54 @@ def show_artist(artist_id):
     'seeking_venue': artist.seeking_venue,
     'seeking_description': artist.seeking_description,
     'image_link': artist.image_link,
-    'past_shows': get_past_shows(artist.id, 'artist'),
-    'upcoming_shows': get_upcoming_shows(artist.id, 'artist'),
-    'past_shows_count': len(get_past_shows(artist.id, 'artist')),
-    'upcoming_shows_count': len(get_upcoming_shows(artist.id, 'artist'))
+    **results['timeline']
   }
 
+  page_cache.tag(*{f"venue:{show['venue_id']}" for show in data['past_shows'] + data['upcoming_shows']})
+
   return render_template('pages/show_artist.html', artist=data)
 
+#  Calendars
+#  ----------------------------------------------------------------
+
+def calendar_page(model, id):
+  # ?month=YYYY-MM, the current month by default. cached per month, and
+  # dropped with the owner's tag whenever one of its shows changes.
+  month = parse_month(request.args.get('month'))
+  if month is None:
+    abort(400)
+
+  owner = model.__tablename__[:-1]
+  results = fan_out({
+    'owner': lambda: db.session.get(model, id),
+    'calendar': lambda: month_calendar(owner, id, month)
+  })
+  if results['owner'] is None:
+    abort(404)
+
+  other = 'artist' if owner == 'venue' else 'venue'
+  page_cache.tag(*calendar_tags(owner, id, results['calendar']))
+
+  return render_template(
+    'pages/calendar.html', kind=owner, other=other, owner=results['owner'], **results['calendar']
+  )
+
+@app.route('/venues/<int:venue_id>/calendar')
+@page_cache.cached('venue:{venue_id}')
+def venue_calendar(venue_id):
+  return calendar_page(Venue, venue_id)
+
+@app.route('/artists/<int:artist_id>/calendar')
+@page_cache.cached('artist:{artist_id}')
+def artist_calendar(artist_id):
+  return calendar_page(Artist, artist_id)
+
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   form = ArtistForm()
   artist = Artist.query.get(artist_id)
-  artist.genres = ''.join([str(i) for i in artist.genres])[1:-1].split(',')
 
   # DONE: populate form with fields from artist with ID <artist_id>
   return render_template('forms/edit_artist.html', form=form, artist=artist)
@@ -376,6 +372,7 @@ def edit_artist_submission(artist_id):
 
       db.session.add(artist)
       db.session.commit()
+      page_cache.invalidate('artists', f'artist:{artist_id}', 'shows')
       flash('Artist ' + request.form['name'] + ' was successfully edited!')
 
     except:
@@ -424,6 +421,7 @@ def edit_venue_submission(venue_id):
 
       db.session.add(venue)
       db.session.commit()
+      page_cache.invalidate('venues', f'venue:{venue_id}', 'shows')
       flash('Venue ' + request.form['name'] + ' was successfully edited!')
 
     except:
@@ -472,6 +470,7 @@ def create_artist_submission():
 
       db.session.add(artist)
       db.session.commit()
+      page_cache.invalidate('artists')
       flash('Artist ' + request.form['name'] + ' was successfully listed!')
 
     except:
@@ -497,23 +496,13 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@page_cache.cached('shows')
 def shows():
   # displays list of shows at /shows
   # DONE: replace with real venues data.
-  data = []
-  shows = Show.query.all()
-  
-  for show in shows:
-    data.append({
-      'venue_id': show.venues.id,
-      'venue_name': show.venues.name,
-      'artist_id': show.artists.id,
-      'artist_name': show.artists.name,
-      'artist_image_link': show.artists.image_link,
-      'start_time': format_datetime(show.start_time)
-    })
-
-  return render_template('pages/shows.html', shows=data)
+  feed = shows_feed(request.args.get('after'))
+
+  return stream_template('pages/shows.html', **feed)
 
 @app.route('/shows/create')
 def create_shows():
@@ -529,15 +518,23 @@ def create_show_submission():
 
   if form.validate_on_submit():
     try:
-      show = Show(
-        venue_id=form.venue_id.data,
-        artist_id=form.artist_id.data,
-        start_time=form.start_time.data,
-      )
-
-      db.session.add(show)
-      db.session.commit()
-      flash('Show was successfully listed!')
+      show = Show(**with_end_time({
+        'venue_id': int(form.venue_id.data),
+        'artist_id': int(form.artist_id.data),
+        'start_time': form.start_time.data,
+        'end_time': form.end_time.data,
+      }))
+      conflicts = show_conflicts(show.venue_id, show.artist_id, show.start_time, show.end_time)
+
+      if conflicts:
+        for conflict in conflicts:
+          flash(describe_conflict(conflict))
+        flash('Show could not be listed.')
+      else:
+        db.session.add(show)
+        db.session.commit()
+        page_cache.invalidate('shows', 'venues', f'venue:{show.venue_id}', f'artist:{show.artist_id}')
+        flash('Show was successfully listed!')
 
     except:
       db.session.rollback()
@@ -558,6 +555,60 @@ def create_show_submission():
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
+#  Import
+#  ----------------------------------------------------------------
+
+@app.route('/import/<entity>', methods=['POST'])
+def import_upload(entity):
+  # multipart upload of a CSV or NDJSON file in the 'file' field, streamed
+  # from werkzeug's spooled temp file straight into the import. it carries
+  # the session's CSRF token in the csrf_token field or the X-CSRFToken
+  # header; bodies over MAX_CONTENT_LENGTH are refused with a 413.
+  upload = request.files.get('file')
+  if entity not in IMPORT_ENTITIES or upload is None:
+    abort(400)
+
+  if app.config.get('WTF_CSRF_ENABLED', True):
+    try:
+      validate_csrf(request.form.get('csrf_token') or request.headers.get('X-CSRFToken'))
+    except ValidationError as e:
+      abort(400, str(e))
+
+  format = request.form.get('format') or ('csv' if upload.filename.endswith('.csv') else 'ndjson')
+  report = import_stream(entity, upload.stream, format)
+
+  return jsonify(report.as_dict())
+
+#  Export
+#  ----------------------------------------------------------------
+
+@app.route('/export/<entity>.<any(ndjson, csv):format>')
+def export(entity, format):
+  # ?since=<iso datetime> and ?after_id=<id> select an incremental export
+  if entity not in EXPORTS:
+    abort(404)
+
+  try:
+    since = request.args.get('since')
+    since = since and datetime.fromisoformat(since)
+    after_id = request.args.get('after_id', type=int)
+  except ValueError:
+    abort(400)
+
+  compress = 'gzip' in request.accept_encodings
+  try:
+    chunks = export_chunks(entity, format, since, after_id, compress)
+  except ValueError:
+    abort(400)
+
+  response = Response(stream_with_context(chunks), mimetype=MIMETYPES[format])
+  response.headers['Content-Disposition'] = f'attachment; filename={entity}.{format}'
+  response.vary.add('Accept-Encoding')
+  if compress:
+    response.headers['Content-Encoding'] = 'gzip'
+
+  return response
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
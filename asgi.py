@@ -0,0 +1,238 @@
+import asyncio
+from asgiref.wsgi import WsgiToAsgi
+from flask import render_template, request
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import HTTPException, NotFound
+from werkzeug.routing import Map, Rule
+from werkzeug.test import EnvironBuilder
+from app import app
+from models import Venue, Artist
+from queries import (
+  PROFILE_SHOWS_LIMIT, venue_directory_stmt, venue_directory_page, artist_directory_stmt,
+  show_timeline_stmt, partition_timeline, shows_feed_stmt, shows_feed_page, decode_cursor
+)
+from facets import facet_filters, facet_counts_stmt, group_facets
+from projections import ArtistListing, project
+from search import SEARCH_RESULTS_LIMIT, postgres_search_stmt, search_results
+from cache import page_cache
+
+#----------------------------------------------------------------------------#
+# ASGI serving mode.
+#----------------------------------------------------------------------------#
+#
+#   uvicorn asgi:application --workers 4
+#
+# the read pages below run as coroutines on SQLAlchemy's asyncio engine
+# (asyncpg on Postgres, aiosqlite on SQLite), so a worker keeps serving while
+# their queries wait on the database. everything else -- forms, edits,
+# imports, the API -- is the unchanged Flask app, run in a thread pool.
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+wsgi = WsgiToAsgi(app)
+engines = {}
+
+
+def async_engine():
+  # one engine per event loop: asyncpg connections can't cross loops
+  loop = asyncio.get_running_loop()
+  if loop not in engines:
+    config = app.config
+    url = make_url(config['ASYNC_DATABASE_URI'] or config['SQLALCHEMY_DATABASE_URI'])
+    url = url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+    options = {}
+
+    if url.get_backend_name() != 'sqlite':
+      options.update(
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT'],
+        pool_recycle=config['DB_POOL_RECYCLE'],
+        pool_pre_ping=config['DB_POOL_PRE_PING'],
+      )
+    if url.get_backend_name() == 'postgresql' and config['DB_STATEMENT_TIMEOUT_MS']:
+      options['connect_args'] = {
+        'server_settings': {'statement_timeout': str(config['DB_STATEMENT_TIMEOUT_MS'])}
+      }
+
+    engines[loop] = create_async_engine(url, **options)
+
+  return engines[loop]
+
+
+async def fetch(stmt):
+  async with async_engine().connect() as connection:
+    return (await connection.execute(stmt)).all()
+
+
+#  Views
+#  ----------------------------------------------------------------
+#  same statements, and the same templates, as the views in app.py.
+#  each returns (response, cache tags).
+
+async def venues():
+  page = max(request.args.get('page', 1, type=int), 1)
+  filters = facet_filters(request.args)
+  rows, facets = await asyncio.gather(
+    fetch(venue_directory_stmt(page, filters=filters)),
+    fetch(facet_counts_stmt(Venue, filters))
+  )
+  return render_template(
+    'pages/venues.html', filters=filters, facets=group_facets(facets), **venue_directory_page(rows, page)
+  ), {'venues'}
+
+
+async def profile(model, id):
+  # the venue/artist row and its show timeline, queried concurrently
+  kind = model.__tablename__[:-1]
+  owner, shows = await asyncio.gather(
+    fetch(select(model.__table__).where(model.id == id)),
+    fetch(show_timeline_stmt(id, kind, PROFILE_SHOWS_LIMIT, PROFILE_SHOWS_LIMIT))
+  )
+  if not owner:
+    raise NotFound()
+
+  data = {**owner[0]._mapping, **partition_timeline(shows)}
+  # an artist page lists venues and a venue page lists artists
+  other = 'artist' if kind == 'venue' else 'venue'
+  tags = {f'{kind}:{id}'} | {
+    f"{other}:{show[other + '_id']}" for show in data['past_shows'] + data['upcoming_shows']
+  }
+
+  return render_template(f'pages/show_{kind}.html', **{kind: data}), tags
+
+
+async def show_venue(venue_id):
+  return await profile(Venue, venue_id)
+
+
+async def show_artist(artist_id):
+  return await profile(Artist, artist_id)
+
+
+async def artists():
+  filters = facet_filters(request.args)
+  rows, facets = await asyncio.gather(
+    fetch(artist_directory_stmt(filters)),
+    fetch(facet_counts_stmt(Artist, filters))
+  )
+  return render_template(
+    'pages/artists.html', artists=project(ArtistListing, rows), filters=filters, facets=group_facets(facets)
+  ), {'artists'}
+
+
+async def shows():
+  rows = await fetch(shows_feed_stmt(decode_cursor(request.args.get('after'))))
+  return render_template('pages/shows.html', **shows_feed_page(rows)), {'shows'}
+
+
+async def search(model, template):
+  search_term = request.form.get('search_term', '')
+  rows = await fetch(postgres_search_stmt(model, search_term, SEARCH_RESULTS_LIMIT, facet_filters(request.args)))
+  results = search_results(model, rows, rows[0].total if rows else 0)
+  return render_template(template, results=results, search_term=search_term), set()
+
+
+async def search_venues():
+  return await search(Venue, 'pages/search_venues.html')
+
+
+async def search_artists():
+  return await search(Artist, 'pages/search_artists.html')
+
+
+routes = Map([
+  Rule('/venues', endpoint=venues, methods=['GET']),
+  Rule('/venues/<int:venue_id>', endpoint=show_venue, methods=['GET']),
+  Rule('/artists', endpoint=artists, methods=['GET']),
+  Rule('/artists/<int:artist_id>', endpoint=show_artist, methods=['GET']),
+  Rule('/shows', endpoint=shows, methods=['GET']),
+])
+# the in-process search index behind SQLite is synchronous
+search_routes = [
+  Rule('/venues/search', endpoint=search_venues, methods=['POST']),
+  Rule('/artists/search', endpoint=search_artists, methods=['POST']),
+]
+
+
+#  Application
+#  ----------------------------------------------------------------
+
+async def read_body(receive):
+  body = b''
+  while True:
+    message = await receive()
+    body += message.get('body', b'')
+    if not message.get('more_body'):
+      return body
+
+
+def request_environ(scope, body):
+  headers = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope['headers']}
+  host = headers.get('host') or '%s:%d' % tuple(scope['server'] or ('localhost', 80))
+
+  return EnvironBuilder(
+    path=scope['path'],
+    base_url=f"{scope['scheme']}://{host}{scope.get('root_path', '')}",
+    query_string=scope['query_string'].decode('latin-1'),
+    method=scope['method'],
+    headers=headers,
+    content_type=headers.get('content-type'),
+    data=body,
+  ).get_environ()
+
+
+async def dispatch(view, arguments, environ):
+  # Flask's request handling around an async view: the before/after request
+  # hooks (metrics, sessions), the page cache and the registered error pages
+  # all apply as they do under WSGI. the async engine has no replica routing,
+  # so these views always read from the primary.
+  with app.request_context(environ):
+    try:
+      response = app.preprocess_request() or page_cache.lookup()
+      if response is None:
+        rendered, tags = await view(**arguments)
+        response = page_cache.save(app.make_response(rendered), tags)
+    except HTTPException as e:
+      response = app.handle_user_exception(e)
+    except Exception as e:
+      response = app.handle_exception(e)
+
+    response = app.make_response(response)
+    return app.process_response(response)
+
+
+async def application(scope, receive, send):
+  if scope['type'] != 'http':
+    return await wsgi(scope, receive, send)
+
+  adapter = routes.bind('', url_scheme=scope['scheme'])
+  try:
+    view, arguments = adapter.match(scope['path'], method=scope['method'])
+  except HTTPException:
+    # not an async read page; Flask handles it, including real 404s
+    return await wsgi(scope, receive, send)
+
+  environ = request_environ(scope, await read_body(receive))
+  response = await dispatch(view, arguments, environ)
+
+  await send({
+    'type': 'http.response.start',
+    'status': response.status_code,
+    'headers': [
+      (key.lower().encode('latin-1'), value.encode('latin-1'))
+      for key, value in response.headers.to_wsgi_list()
+    ],
+  })
+  await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+def configure_routes():
+  if make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name() == 'postgresql':
+    for rule in search_routes:
+      routes.add(rule)
+
+
+configure_routes()
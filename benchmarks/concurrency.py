@@ -0,0 +1,150 @@
+# Requests/sec and latency of the read pages under many concurrent clients,
+# WSGI (gunicorn, sync workers) against ASGI (uvicorn + asgi.py), on the same
+# database and with the same number of worker processes.
+#
+#   python benchmarks/seed.py
+#   python benchmarks/concurrency.py --workers 4 --concurrency 200 --seconds 20
+#
+# pages are requested with Cache-Control: no-cache so every request renders
+# and queries; pass --cached to measure page cache hits instead.
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import time
+from statistics import quantiles
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PATHS = ['/venues', '/artists', '/shows', '/venues/1', '/artists/1', '/venues/2', '/artists/2']
+
+SERVERS = {
+  'wsgi': 'gunicorn --workers {workers} --bind 127.0.0.1:{port} app:app',
+  'asgi': 'uvicorn asgi:application --workers {workers} --port {port} --no-access-log',
+}
+
+
+async def read_response(reader):
+  # (status, whether the connection stays open)
+  status = int((await reader.readline()).split()[1])
+  length, chunked, keep_alive = None, False, True
+
+  while True:
+    line = await reader.readline()
+    if line in (b'\r\n', b''):
+      break
+    name, _, value = line.decode('latin-1').partition(':')
+    name = name.strip().lower()
+    if name == 'content-length':
+      length = int(value)
+    elif name == 'transfer-encoding' and 'chunked' in value:
+      chunked = True
+    elif name == 'connection' and 'close' in value.lower():
+      keep_alive = False
+
+  if chunked:
+    while True:
+      size = int((await reader.readline()).split(b';')[0], 16)
+      await reader.readexactly(size + 2)
+      if size == 0:
+        break
+  elif length:
+    await reader.readexactly(length)
+
+  return status, keep_alive
+
+
+async def client(port, paths, headers, deadline, latencies, errors):
+  # one client issuing requests back to back, over a keep-alive connection
+  # where the server allows it (gunicorn's sync workers close after each)
+  writer = None
+  i = 0
+
+  try:
+    while time.monotonic() < deadline:
+      path = paths[i % len(paths)]
+      i += 1
+      started = time.perf_counter()
+      if writer is None:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+      writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n'.encode())
+      await writer.drain()
+      status, keep_alive = await read_response(reader)
+      latencies.append(time.perf_counter() - started)
+      if status != 200:
+        errors.append(status)
+      if not keep_alive:
+        writer.close()
+        writer = None
+  except (ConnectionError, asyncio.IncompleteReadError, IndexError) as e:
+    errors.append(type(e).__name__)
+  finally:
+    if writer is not None:
+      writer.close()
+
+
+async def load(port, concurrency, seconds, cached):
+  headers = '' if cached else 'Cache-Control: no-cache\r\n'
+  latencies, errors = [], []
+  deadline = time.monotonic() + seconds
+
+  await asyncio.gather(*(
+    # stagger the starting page so clients don't move in lockstep
+    client(port, PATHS[i % len(PATHS):] + PATHS[:i % len(PATHS)], headers, deadline, latencies, errors)
+    for i in range(concurrency)
+  ))
+
+  return latencies, errors
+
+
+def wait_for(port, timeout=30):
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    try:
+      socket.create_connection(('127.0.0.1', port)).close()
+      return
+    except OSError:
+      time.sleep(0.2)
+  raise SystemExit(f'Nothing is listening on port {port}.')
+
+
+def run(mode, args, port):
+  command = SERVERS[mode].format(workers=args.workers, port=port)
+  server = subprocess.Popen(command.split(), cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+  try:
+    wait_for(port)
+    # warm up templates, engines and pools
+    asyncio.run(load(port, args.workers * 2, 2, args.cached))
+    latencies, errors = asyncio.run(load(port, args.concurrency, args.seconds, args.cached))
+  finally:
+    server.terminate()
+    server.wait()
+
+  cuts = quantiles(latencies, n=100, method='inclusive')
+  print(
+    f'{mode:<5} {len(latencies) / args.seconds:10.1f} {cuts[49] * 1000:9.1f} '
+    f'{cuts[94] * 1000:9.1f} {cuts[98] * 1000:9.1f} {len(errors):7}'
+  )
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--workers', type=int, default=4)
+  parser.add_argument('--concurrency', type=int, default=100)
+  parser.add_argument('--seconds', type=int, default=15)
+  parser.add_argument('--cached', action='store_true')
+  parser.add_argument('--mode', choices=sorted(SERVERS), action='append')
+  args = parser.parse_args()
+
+  print(f'{args.concurrency} clients, {args.workers} workers, {args.seconds}s per mode')
+  print(f"{'mode':<5} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+
+  for port, mode in enumerate(args.mode or ['wsgi', 'asgi'], start=8101):
+    run(mode, args, port)
+
+
+if __name__ == '__main__':
+  main()
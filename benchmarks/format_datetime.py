@@ -0,0 +1,79 @@
+# Compares the original format_datetime filter with formatting.py on a
+# shows-page sized column of timestamps.
+#
+#   python benchmarks/format_datetime.py [--rows 5000] [--distinct 500]
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+from timeit import repeat
+
+import babel.dates
+import dateutil.parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import formatting
+
+
+def legacy_format_datetime(value, format='medium'):
+  # app.py's filter before formatting.py
+  if isinstance(value, str):
+    date = dateutil.parser.parse(value)
+  else:
+    date = value
+
+  if format == 'full':
+      format="EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+      format="EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format, locale='en')
+
+
+def column(rows, distinct):
+  # a listing repeats start times: several shows share a slot
+  start = datetime(2030, 1, 1, 20, 0)
+  return [start + timedelta(hours=i % distinct) for i in range(rows)]
+
+
+def best(statement, number=3):
+  return min(repeat(statement, number=1, repeat=number))
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--rows', type=int, default=5000)
+  parser.add_argument('--distinct', type=int, default=500)
+  args = parser.parse_args()
+
+  values = column(args.rows, args.distinct)
+  strings = [value.isoformat() for value in values]
+
+  for format in ('full', 'medium'):
+    assert [legacy_format_datetime(v, format) for v in values] == formatting.format_datetimes(values, format)
+
+  def cold(call):
+    formatting.format_datetime.cache_clear()
+    call()
+
+  cases = [
+    ('legacy, per row', lambda: [legacy_format_datetime(v, 'full') for v in values]),
+    ('legacy, per row (strings)', lambda: [legacy_format_datetime(v, 'full') for v in strings]),
+    ('cached, per row, cold memo', lambda: cold(lambda: [formatting.format_datetime(v, 'full') for v in values])),
+    ('cached, per row, warm memo', lambda: [formatting.format_datetime(v, 'full') for v in values]),
+    ('cached, per row (strings)', lambda: cold(lambda: [formatting.format_datetime(v, 'full') for v in strings])),
+    ('batch, cold memo', lambda: cold(lambda: formatting.format_datetimes(values, 'full'))),
+  ]
+
+  print(f'{args.rows} rows, {args.distinct} distinct timestamps')
+  baseline = None
+
+  for name, call in cases:
+    seconds = best(call)
+    baseline = baseline or seconds
+    print(f'{name:<30} {seconds * 1000:9.2f} ms  {baseline / seconds:6.1f}x')
+
+
+if __name__ == '__main__':
+  main()
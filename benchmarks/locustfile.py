@@ -0,0 +1,47 @@
+# Concurrent load against a running server, for what the single-threaded
+# runner can't show (pool waits, cache contention, worker counts):
+#
+#   locust -f benchmarks/locustfile.py --host http://localhost:5000
+#
+# locust is not a dependency of the app; install it where the load runs.
+
+import random
+
+from locust import HttpUser, between, task
+
+VENUE_IDS = range(1, 201)
+ARTIST_IDS = range(1, 501)
+TERMS = ['hall', 'blue', 'trio', 'neon', 'jazz']
+
+
+class Visitor(HttpUser):
+  wait_time = between(0.5, 2)
+
+  @task(4)
+  def venues(self):
+    self.client.get('/venues')
+
+  @task(4)
+  def shows(self):
+    self.client.get('/shows')
+
+  @task(6)
+  def venue(self):
+    self.client.get(f'/venues/{random.choice(VENUE_IDS)}', name='/venues/[id]')
+
+  @task(6)
+  def artist(self):
+    self.client.get(f'/artists/{random.choice(ARTIST_IDS)}', name='/artists/[id]')
+
+  @task(2)
+  def artists(self):
+    self.client.get('/artists')
+
+  @task(3)
+  def search(self):
+    kind = random.choice(['venues', 'artists'])
+    self.client.post(f'/{kind}/search', data={'search_term': random.choice(TERMS)}, name=f'/{kind}/search')
+
+  @task(2)
+  def api_shows(self):
+    self.client.get('/api/v1/shows?fields=venue_name,artist_name,start_time', name='/api/v1/shows')
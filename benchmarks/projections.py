@@ -0,0 +1,122 @@
+# Time and memory of the list views' row loading: full ORM objects turned
+# into dicts (the original views) against the column-only projections of
+# projections.py, over every row of the configured database.
+#
+#   python benchmarks/seed.py --venues 20000 --artists 50000 --shows 0
+#   python benchmarks/projections.py
+#
+# memory is the tracemalloc peak while loading and what the result still
+# holds afterwards.
+
+import argparse
+import os
+import sys
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import app
+from models import db, Venue, Artist
+from projections import VenueListing, ArtistListing, SEARCH_HITS, projected, fetch_projected
+
+
+def legacy_venues():
+  # venues() before the venue directory query
+  venues = [x.__dict__ for x in Venue.query.all()]
+  return [{
+    'id': venue['id'],
+    'name': venue['name'],
+    'city': venue['city'],
+    'state': venue['state'],
+    'num_upcoming_shows': venue['upcoming_shows_count']
+  } for venue in venues]
+
+
+def legacy_artists():
+  artists = [x.__dict__ for x in Artist.query.all()]
+  return [{'id': artist['id'], 'name': artist['name']} for artist in artists]
+
+
+def legacy_search(model, term):
+  matches = [x.__dict__ for x in model.query.filter(model.name.ilike(f'%{term}%')).all()]
+  return [{
+    'id': match['id'],
+    'name': match['name'],
+    'num_upcoming_shows': match['upcoming_shows_count']
+  } for match in matches]
+
+
+def column_dicts(stmt):
+  # column-only select, one dict per row
+  return [dict(row._mapping) for row in db.session.execute(stmt)]
+
+
+def projected_search(model, term):
+  return fetch_projected(SEARCH_HITS[model], projected(SEARCH_HITS[model]).where(model.name.ilike(f'%{term}%')))
+
+
+def routes(term):
+  # route: [(approach, load)]
+  return {
+    'venues': [
+      ('orm objects', legacy_venues),
+      ('column dicts', lambda: column_dicts(projected(VenueListing))),
+      ('projection', lambda: fetch_projected(VenueListing, projected(VenueListing))),
+    ],
+    'artists': [
+      ('orm objects', legacy_artists),
+      ('column dicts', lambda: column_dicts(projected(ArtistListing))),
+      ('projection', lambda: fetch_projected(ArtistListing, projected(ArtistListing))),
+    ],
+    'search_venues': [
+      ('orm objects', lambda: legacy_search(Venue, term)),
+      ('projection', lambda: projected_search(Venue, term)),
+    ],
+    'search_artists': [
+      ('orm objects', lambda: legacy_search(Artist, term)),
+      ('projection', lambda: projected_search(Artist, term)),
+    ],
+  }
+
+
+def measure(load, repeat):
+  # (best seconds, peak bytes, retained bytes, rows). each run starts from an
+  # empty session, as a request would.
+  seconds = []
+  for _ in range(repeat):
+    db.session.remove()
+    started = perf_counter()
+    load()
+    seconds.append(perf_counter() - started)
+
+  db.session.remove()
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  result = load()
+  retained, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  return min(seconds), peak - before, retained - before, len(result)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--repeat', type=int, default=5)
+  parser.add_argument('--term', default='a', help='Search term for the search routes.')
+  args = parser.parse_args()
+
+  print(f"{'route':<15} {'approach':<13} {'rows':>7} {'ms':>9} {'peak MB':>9} {'kept MB':>9}")
+
+  with app.app_context():
+    for route, approaches in routes(args.term).items():
+      for approach, load in approaches:
+        seconds, peak, retained, rows = measure(load, args.repeat)
+        print(
+          f'{route:<15} {approach:<13} {rows:7} {seconds * 1000:9.2f} '
+          f'{peak / 2 ** 20:9.2f} {retained / 2 ** 20:9.2f}'
+        )
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,204 @@
+# Replays every route against the configured (seeded) database and reports
+# latency percentiles, statements per request and peak RSS per scenario.
+#
+#   python benchmarks/seed.py
+#   python benchmarks/run.py                  # report only
+#   python benchmarks/run.py --save-baseline  # store benchmarks/baseline.json
+#   python benchmarks/run.py --compare        # exit 1 on a regression
+#   python benchmarks/run.py --compare --latency  # p95 growth counts too
+#
+# Latency baselines are only comparable on the machine and database they
+# were recorded on, so --compare gates on statements and rows fetched per
+# request, which are comparable anywhere, unless --latency is given.
+
+import argparse
+import json
+import os
+import resource
+import sys
+from statistics import quantiles
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import select, func
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def scenarios(db, writes=False):
+  # (name, method, url, form data). ids are picked from the seeded data so
+  # every page has shows to render.
+  from models import Show
+
+  venue_id, artist_id = db.session.execute(
+    select(Show.venue_id, Show.artist_id).order_by(Show.id).limit(1)
+  ).one()
+  middle = db.session.execute(
+    select(Show.start_time, Show.id).order_by(Show.start_time, Show.id)
+    .offset(db.session.scalar(select(func.count(Show.id))) // 2).limit(1)
+  ).one()
+  cursor = f'{middle.start_time.isoformat()}_{middle.id}'
+  month = middle.start_time.strftime('%Y-%m')
+
+  cases = [
+    ('home', 'GET', '/', None),
+    ('venues', 'GET', '/venues', None),
+    ('venues_page_2', 'GET', '/venues?page=2', None),
+    ('search_venues', 'POST', '/venues/search', {'search_term': 'hall'}),
+    ('show_venue', 'GET', f'/venues/{venue_id}', None),
+    ('edit_venue', 'GET', f'/venues/{venue_id}/edit', None),
+    ('new_venue', 'GET', '/venues/create', None),
+    ('artists', 'GET', '/artists', None),
+    ('search_artists', 'POST', '/artists/search', {'search_term': 'trio'}),
+    ('show_artist', 'GET', f'/artists/{artist_id}', None),
+    ('edit_artist', 'GET', f'/artists/{artist_id}/edit', None),
+    ('new_artist', 'GET', '/artists/create', None),
+    ('shows', 'GET', '/shows', None),
+    ('shows_deep', 'GET', f'/shows?after={cursor}', None),
+    ('new_show', 'GET', '/shows/create', None),
+    ('venue_calendar', 'GET', f'/venues/{venue_id}/calendar?month={month}', None),
+    ('api_venues', 'GET', '/api/v1/venues', None),
+    ('api_venue', 'GET', f'/api/v1/venues/{venue_id}?include=shows', None),
+    ('api_shows', 'GET', '/api/v1/shows?fields=venue_name,artist_name,start_time', None),
+    ('api_search', 'GET', '/api/v1/artists/search?q=trio', None),
+    ('venues_near', 'GET', '/venues/near?near=Austin, TX&radius_km=50', None),
+    ('api_near', 'GET', '/api/v1/venues/near?lat=30.27&lon=-97.74&limit=20', None),
+    ('api_calendar', 'GET', f'/api/v1/artists/{artist_id}/calendar?month={month}', None),
+    ('export_venues', 'GET', '/export/venues.ndjson', None),
+  ]
+
+  if writes:
+    # every iteration adds rows, so these are kept out of the default run
+    links = {
+      'image_link': 'https://images.example.com/new.jpg',
+      'facebook_link': 'https://www.facebook.com/new',
+      'website_link': 'https://new.example.com',
+    }
+    cases += [
+      ('create_venue', 'POST', '/venues/create', dict(
+        links, name='Bench Hall', city='Austin', state='TX', address='1 Main Street',
+        phone='512-555-1234', genres='Jazz'
+      )),
+      ('create_artist', 'POST', '/artists/create', dict(
+        links, name='Bench Trio', city='Austin', state='TX', phone='512-555-1234', genres='Jazz'
+      )),
+      # only the first one is listed; the others time the double-booking check
+      ('create_show', 'POST', '/shows/create', {
+        'venue_id': venue_id, 'artist_id': artist_id, 'start_time': '2030-01-01 20:00:00'
+      }),
+    ]
+
+  return cases
+
+
+def peak_rss_kb():
+  # ru_maxrss is in kilobytes on Linux and bytes on macOS
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def percentiles(samples):
+  cuts = quantiles(samples, n=100, method='inclusive')
+  return {'p50': round(cuts[49], 3), 'p95': round(cuts[94], 3), 'p99': round(cuts[98], 3)}
+
+
+def measure(app, db, cases, iterations, warmup, cached):
+  from instrumentation import QueryCapture
+
+  client = app.test_client()
+  # cached runs measure page cache hits; by default every page is rendered
+  headers = {} if cached else {'Cache-Control': 'no-cache'}
+  results = {}
+
+  for name, method, url, form in cases:
+    samples = []
+    queries = rows = 0
+
+    for i in range(warmup + iterations):
+      with QueryCapture(db.engine) as capture:
+        started = perf_counter()
+        response = client.open(url, method=method, data=form, headers=headers)
+        response.get_data()
+        elapsed = perf_counter() - started
+        response.close()
+        db.session.remove()
+
+      if response.status_code != 200:
+        raise SystemExit(f'{name}: {method} {url} returned {response.status_code}')
+      if i >= warmup:
+        samples.append(elapsed * 1000)
+        queries = max(queries, len(capture))
+        rows = max(rows, capture.rows)
+
+    results[name] = dict(percentiles(samples), queries=queries, rows=rows, rss_kb=peak_rss_kb())
+
+  return results
+
+
+def regressions(results, baseline, tolerance=None):
+  # a scenario regresses when it issues more statements or fetches more rows
+  # than before, or, given a tolerance, when its p95 grows past it
+  found = []
+
+  for name, result in results.items():
+    before = baseline.get(name)
+    if before is None:
+      continue
+    if tolerance is not None and result['p95'] > before['p95'] * (1 + tolerance):
+      found.append(f"{name}: p95 {result['p95']:.2f}ms, baseline {before['p95']:.2f}ms")
+    if result['queries'] > before['queries']:
+      found.append(f"{name}: {result['queries']} queries, baseline {before['queries']}")
+    if 'rows' in before and result['rows'] > before['rows']:
+      found.append(f"{name}: {result['rows']} rows, baseline {before['rows']}")
+
+  return found
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--iterations', type=int, default=30)
+  parser.add_argument('--warmup', type=int, default=3)
+  parser.add_argument('--only', action='append', help='Run only these scenarios.')
+  parser.add_argument('--writes', action='store_true', help='Include the create routes.')
+  parser.add_argument('--cached', action='store_true', help='Measure page cache hits.')
+  parser.add_argument('--baseline', default=BASELINE)
+  parser.add_argument('--save-baseline', action='store_true')
+  parser.add_argument('--compare', action='store_true')
+  parser.add_argument('--latency', action='store_true', help='Also compare p95, on the baseline machine only.')
+  parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 growth with --latency.')
+  args = parser.parse_args()
+
+  from app import app
+  from models import db
+
+  app.config['WTF_CSRF_ENABLED'] = False
+
+  with app.app_context():
+    cases = [case for case in scenarios(db, args.writes) if not args.only or case[0] in args.only]
+    results = measure(app, db, cases, args.iterations, args.warmup, args.cached)
+
+  print(f"{'scenario':<16} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'rows':>7} {'rss MB':>8}")
+  for name, result in results.items():
+    print(
+      f"{name:<16} {result['p50']:9.2f} {result['p95']:9.2f} {result['p99']:9.2f} "
+      f"{result['queries']:8} {result['rows']:7} {result['rss_kb'] / 1024:8.1f}"
+    )
+
+  if args.save_baseline:
+    with open(args.baseline, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+    print(f'Saved the baseline to {args.baseline}.')
+
+  if args.compare:
+    with open(args.baseline) as f:
+      found = regressions(results, json.load(f), args.tolerance if args.latency else None)
+    for line in found:
+      print('REGRESSION ' + line)
+    if found:
+      sys.exit(1)
+    print('No regressions against the baseline.')
+
+
+if __name__ == '__main__':
+  main()
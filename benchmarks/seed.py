@@ -0,0 +1,163 @@
+# Fills the configured database with a reproducible synthetic catalog.
+#
+#   DATABASE_URL=sqlite:////tmp/fyyur-bench.db python benchmarks/seed.py --venues 2000 --artists 5000 --shows 50000
+#
+# SQLite databases are (re)created from the models. Postgres databases are
+# expected to be migrated already (flask db upgrade), since the search
+# columns and indexes come from the migrations; their tables are truncated.
+
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import insert
+from geocoding import geocode
+
+CHUNK_SIZE = 5000
+
+AREAS = [
+  ('San Francisco', 'CA'), ('Oakland', 'CA'), ('Los Angeles', 'CA'), ('New York', 'NY'),
+  ('Brooklyn', 'NY'), ('Austin', 'TX'), ('Houston', 'TX'), ('Chicago', 'IL'),
+  ('Seattle', 'WA'), ('Portland', 'OR'), ('Nashville', 'TN'), ('New Orleans', 'LA'),
+  ('Denver', 'CO'), ('Atlanta', 'GA'), ('Boston', 'MA'), ('Detroit', 'MI'),
+]
+GENRES = [
+  'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk',
+  'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop',
+  'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other',
+]
+VENUE_WORDS = ['Blue', 'Velvet', 'Dueling', 'Park', 'Musical', 'Golden', 'Iron', 'Copper', 'Lantern', 'Echo']
+VENUE_KINDS = ['Hall', 'Room', 'Hop', 'Lounge', 'Club', 'Theatre', 'Pianos', 'Garage']
+ARTIST_WORDS = ['Guns', 'Matt', 'Wild', 'Sand', 'Electric', 'Quiet', 'Neon', 'Paper', 'Static', 'Honey']
+ARTIST_KINDS = ['Petals', 'Quevado', 'Sax Band', 'Collective', 'Trio', 'Quartet', 'Orchestra', 'Ensemble']
+
+
+def chunks(rows, size=CHUNK_SIZE):
+  chunk = []
+  for row in rows:
+    chunk.append(row)
+    if len(chunk) == size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+def venue_rows(rng, count):
+  for i in range(count):
+    city, state = rng.choice(AREAS)
+    name = f'{rng.choice(VENUE_WORDS)} {rng.choice(VENUE_KINDS)} {i}'
+    # core inserts skip the geocoding listener; spread venues around the city
+    latitude, longitude = geocode(city=city, state=state)
+    yield {
+      'name': name,
+      'genres': rng.sample(GENRES, rng.randint(1, 3)),
+      'address': f'{rng.randint(1, 9999)} Main Street',
+      'city': city,
+      'state': state,
+      'phone': f'{rng.randint(200, 999)}-555-{rng.randint(1000, 9999)}',
+      'website': f'https://venue{i}.example.com',
+      'facebook_link': f'https://www.facebook.com/venue{i}',
+      'seeking_talent': rng.random() < 0.3,
+      'seeking_description': 'Looking for local acts.' if rng.random() < 0.3 else None,
+      'image_link': f'https://images.example.com/venues/{i}.jpg',
+      'latitude': latitude + rng.uniform(-0.2, 0.2),
+      'longitude': longitude + rng.uniform(-0.2, 0.2),
+    }
+
+
+def artist_rows(rng, count):
+  for i in range(count):
+    city, state = rng.choice(AREAS)
+    yield {
+      'name': f'{rng.choice(ARTIST_WORDS)} {rng.choice(ARTIST_KINDS)} {i}',
+      'genres': rng.sample(GENRES, rng.randint(1, 3)),
+      'city': city,
+      'state': state,
+      'phone': f'{rng.randint(200, 999)}-555-{rng.randint(1000, 9999)}',
+      'website': f'https://artist{i}.example.com',
+      'facebook_link': f'https://www.facebook.com/artist{i}',
+      'seeking_venue': rng.random() < 0.3,
+      'seeking_description': None,
+      'image_link': f'https://images.example.com/artists/{i}.jpg',
+    }
+
+
+def show_rows(rng, count, venues, artists, now, duration):
+  # a year either side of now, on the hour, so listings share start times.
+  # no venue or artist is booked twice at once (the exclusion constraints
+  # would refuse it), so each keeps the set of hours it is busy.
+  busy = set()
+  hours = int(duration.total_seconds() // 3600)
+
+  for _ in range(count):
+    while True:
+      venue_id, artist_id = rng.randint(1, venues), rng.randint(1, artists)
+      hour = rng.randint(-365 * 24, 365 * 24)
+      taken = {(owner, hour + i) for owner in (('venue', venue_id), ('artist', artist_id)) for i in range(hours)}
+      if not taken & busy:
+        break
+    busy |= taken
+    start_time = now + timedelta(hours=hour)
+    yield {
+      'venue_id': venue_id,
+      'artist_id': artist_id,
+      'start_time': start_time,
+      'end_time': start_time + duration,
+    }
+
+
+def reset(db):
+  if db.engine.dialect.name == 'postgresql':
+    db.session.execute(db.text('TRUNCATE shows, venues, artists RESTART IDENTITY CASCADE'))
+    db.session.commit()
+  else:
+    db.drop_all()
+    db.create_all()
+
+
+def seed(venues=200, artists=500, shows=5000, random_seed=1):
+  from app import app
+  from models import db, Venue, Artist, Show, refresh_show_counters, DEFAULT_SHOW_DURATION
+
+  rng = random.Random(random_seed)
+  now = datetime.now().replace(minute=0, second=0, microsecond=0)
+
+  with app.app_context():
+    reset(db)
+
+    for model, rows in (
+      (Venue, venue_rows(rng, venues)),
+      (Artist, artist_rows(rng, artists)),
+      (Show, show_rows(rng, shows, venues, artists, now, DEFAULT_SHOW_DURATION)),
+    ):
+      for chunk in chunks(rows):
+        db.session.execute(insert(model.__table__), chunk)
+      db.session.commit()
+
+    # shows were inserted without the ORM flush events behind the counters
+    with db.engine.begin() as connection:
+      refresh_show_counters(connection, Venue)
+      refresh_show_counters(connection, Artist)
+
+  return {'venues': venues, 'artists': artists, 'shows': shows}
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--venues', type=int, default=200)
+  parser.add_argument('--artists', type=int, default=500)
+  parser.add_argument('--shows', type=int, default=5000)
+  parser.add_argument('--seed', type=int, default=1, help='Random seed.')
+  args = parser.parse_args()
+
+  counts = seed(args.venues, args.artists, args.shows, args.seed)
+  print('Seeded ' + ', '.join(f'{count} {name}' for name, count in counts.items()) + '.')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,221 @@
+import hashlib
+from collections import OrderedDict, defaultdict
+from functools import wraps
+from multiprocessing.managers import BaseManager
+from threading import RLock
+from time import monotonic
+from flask import Response, g, make_response, request, session, _request_ctx_stack
+
+#----------------------------------------------------------------------------#
+# Cache backends.
+#----------------------------------------------------------------------------#
+
+class LRUCache:
+  # in-process cache bounded by entry count and total value size, with a
+  # per-entry TTL. entries carry tags so writes can drop exactly the pages
+  # they affect: invalidate('venue:3') removes every entry tagged with it.
+
+  def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.lock = RLock()
+    self.entries = OrderedDict()
+    self.tags = defaultdict(set)
+    self.size = 0
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+
+      value, expires, size, tags = entry
+      if expires < monotonic():
+        self.delete(key)
+        return None
+
+      self.entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, ttl, size, tags=()):
+    with self.lock:
+      self.delete(key)
+      if size > self.max_bytes:
+        return
+
+      self.entries[key] = (value, monotonic() + ttl, size, tuple(tags))
+      self.size += size
+      for tag in tags:
+        self.tags[tag].add(key)
+
+      while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+        self.delete(next(iter(self.entries)))
+
+  def delete(self, key):
+    with self.lock:
+      entry = self.entries.pop(key, None)
+      if entry is None:
+        return
+
+      self.size -= entry[2]
+      for tag in entry[3]:
+        keys = self.tags.get(tag)
+        if keys is not None:
+          keys.discard(key)
+          if not keys:
+            del self.tags[tag]
+
+  def invalidate(self, *tags):
+    with self.lock:
+      for tag in tags:
+        for key in list(self.tags.get(tag, ())):
+          self.delete(key)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.tags.clear()
+      self.size = 0
+
+  def stats(self):
+    with self.lock:
+      return {'entries': len(self.entries), 'bytes': self.size}
+
+
+class CacheManager(BaseManager):
+  pass
+
+
+def serve_shared_cache(address, authkey, max_entries, max_bytes):
+  # a local process standing in for a shared cache: every worker connected
+  # to it sees the same entries and the same invalidations
+  cache = LRUCache(max_entries, max_bytes)
+  CacheManager.register('cache', callable=lambda: cache)
+  CacheManager(address=address, authkey=authkey).get_server().serve_forever()
+
+
+def connect_shared_cache(address, authkey):
+  CacheManager.register('cache')
+  manager = CacheManager(address=address, authkey=authkey)
+  manager.connect()
+  return manager.cache()
+
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+class PageCache:
+
+  def __init__(self):
+    self.backend = None
+    self.ttl = 60
+
+  def init_app(self, app):
+    self.ttl = app.config['CACHE_DEFAULT_TTL']
+
+    if not app.config['CACHE_ENABLED']:
+      self.backend = None
+    elif app.config['CACHE_BACKEND'] == 'shared':
+      self.backend = connect_shared_cache(
+        app.config['CACHE_SHARED_ADDRESS'], app.config['CACHE_SHARED_AUTHKEY']
+      )
+    else:
+      self.backend = LRUCache(app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_MAX_BYTES'])
+
+  def invalidate(self, *tags):
+    if self.backend is not None:
+      self.backend.invalidate(*tags)
+
+  def tag(self, *tags):
+    # tags discovered while rendering, e.g. the venues listed on an artist page
+    g.setdefault('cache_tags', set()).update(tags)
+
+  def store(self, key, mimetype, body, tags):
+    entry = (body, mimetype, hashlib.md5(body).hexdigest())
+    self.backend.set(key, entry, self.ttl, len(body), tuple(tags))
+
+  def personal(self):
+    # pages carrying flashed messages are specific to one visitor. the check
+    # has to look before the render too: get_flashed_messages() in the
+    # layout takes them out of the session while the page renders.
+    return bool(
+      g.get('page_cache_flashes')
+      or session.get('_flashes')
+      or _request_ctx_stack.top.flashes
+    )
+
+  def lookup(self):
+    # the cached response for this request, or None when it has to be rendered
+    # (and then handed to save). Cache-Control: no-cache asks for a fresh render.
+    if self.backend is None or request.method != 'GET':
+      return None
+    g.page_cache_flashes = bool(session.get('_flashes'))
+    if g.page_cache_flashes:
+      return None
+    if request.cache_control.no_cache:
+      return None
+
+    entry = self.backend.get('page:' + request.full_path)
+    if entry is None:
+      return None
+
+    body, mimetype, etag = entry
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['X-Cache'] = 'hit'
+    return response.make_conditional(request)
+
+  def save(self, response, tags):
+    if self.backend is None or request.method != 'GET':
+      return response
+    if response.status_code != 200 or self.personal():
+      return response
+
+    key = 'page:' + request.full_path
+    page_tags = set(tags) | g.get('cache_tags', set())
+    response.headers['X-Cache'] = 'miss'
+
+    if response.is_streamed:
+      # keep streaming to the client and store the page once it is done
+      response.response = self.tee(key, response, response.response, page_tags)
+      return response
+
+    body = response.get_data()
+    self.store(key, response.mimetype, body, page_tags)
+    response.set_etag(hashlib.md5(body).hexdigest())
+    return response.make_conditional(request)
+
+  def cached(self, *tags):
+    # caches a GET view's 200 responses per full path. tags are formatted with
+    # the view arguments, e.g. @page_cache.cached('venue:{venue_id}').
+    def decorator(view):
+      @wraps(view)
+      def wrapper(**kwargs):
+        response = self.lookup()
+        if response is not None:
+          return response
+
+        response = make_response(view(**kwargs))
+        return self.save(response, {tag.format(**kwargs) for tag in tags})
+
+      return wrapper
+    return decorator
+
+  def tee(self, key, response, chunks, tags):
+    parts = []
+
+    try:
+      for chunk in chunks:
+        parts.append(chunk if isinstance(chunk, bytes) else chunk.encode(response.charset))
+        yield chunk
+    finally:
+      # lets stream_with_context pop its request context on early close too
+      if hasattr(chunks, 'close'):
+        chunks.close()
+
+    # the request context is gone by now, hence everything is passed in
+    self.store(key, response.mimetype, b''.join(parts), tags)
+
+
+page_cache = PageCache()
@@ -0,0 +1,325 @@
+import re
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, func, update, bindparam, union_all
+from models import db, Venue, Artist, Show, refresh_show_counters, roll_over_show_counters, stale_show_counters, router
+from instrumentation import QueryCapture
+from cache import page_cache, serve_shared_cache
+from importer import ENTITIES, IMPORT_CHUNK_SIZE, import_stream
+from exporter import EXPORTS, export_chunks
+from templating import warm_templates
+from geocoding import geocode
+from queries import VENUES_PER_PAGE, SHOWS_PER_PAGE, PROFILE_SHOWS_LIMIT
+from facets import MAX_FACET_ROWS
+
+# tables whose full scans grow with the catalog, i.e. the hot paths
+HOT_TABLES = ('shows',)
+
+# endpoint: (max statements, max rows fetched). None means unbounded; the
+# search budgets leave room for the in-process index rebuild on SQLite. the
+# listings' second statement is their facet counts.
+QUERY_BUDGETS = {
+  'venues': (2, VENUES_PER_PAGE + 1 + MAX_FACET_ROWS),
+  'artists': (2, None),
+  'shows': (1, SHOWS_PER_PAGE + 1),
+  'search_venues': (2, None),
+  'search_artists': (2, None),
+  'show_venue': (2, 1 + 2 * PROFILE_SHOWS_LIMIT),
+  'show_artist': (2, 1 + 2 * PROFILE_SHOWS_LIMIT),
+  'edit_venue': (1, 1),
+  'edit_artist': (1, 1),
+}
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@click.command('rollover-shows')
+@with_appcontext
+def rollover_shows_command():
+  # run periodically (e.g. from cron) so shows whose start_time has passed
+  # move from the upcoming to the past counters
+  with db.engine.begin() as connection:
+    total = roll_over_show_counters(connection)
+
+  click.echo(f'Rolled over show counters for {total} venues/artists.')
+
+
+@click.command('check-show-counters')
+@click.option('--fix', is_flag=True, help='Recompute the counters of mismatched rows.')
+@with_appcontext
+def check_show_counters_command(fix):
+  mismatched = 0
+
+  with db.engine.begin() as connection:
+    for model in (Venue, Artist):
+      rows = stale_show_counters(connection, model)
+      mismatched += len(rows)
+
+      for row in rows:
+        click.echo(
+          f'{model.__tablename__} {row.id}: upcoming={row.upcoming_shows_count} '
+          f'past={row.past_shows_count} next={row.next_show_time}'
+        )
+
+      if fix:
+        refresh_show_counters(connection, model, [row.id for row in rows])
+
+  if mismatched and not fix:
+    raise click.ClickException(f'{mismatched} rows have stale show counters.')
+
+  click.echo(f'{mismatched} stale rows' + (' fixed.' if fix else '.'))
+
+
+def hot_path_requests():
+  # one request per read view, against ids that exist in the seeded database.
+  # entries are (endpoint, method, url, form data).
+  venue_id = db.session.scalar(select(func.min(Show.venue_id)))
+  artist_id = db.session.scalar(select(func.min(Show.artist_id)))
+  cursor = db.session.execute(select(Show.start_time, Show.id).order_by(Show.start_time, Show.id)).first()
+
+  requests = [
+    ('venues', 'GET', '/venues', None),
+    ('artists', 'GET', '/artists', None),
+    ('shows', 'GET', '/shows', None),
+    ('search_venues', 'POST', '/venues/search', {'search_term': 'music'}),
+    ('search_artists', 'POST', '/artists/search', {'search_term': 'band'}),
+  ]
+
+  if venue_id is not None:
+    requests.append(('show_venue', 'GET', f'/venues/{venue_id}', None))
+    requests.append(('edit_venue', 'GET', f'/venues/{venue_id}/edit', None))
+  if artist_id is not None:
+    requests.append(('show_artist', 'GET', f'/artists/{artist_id}', None))
+    requests.append(('edit_artist', 'GET', f'/artists/{artist_id}/edit', None))
+  if cursor is not None:
+    requests.append(('shows', 'GET', f'/shows?after={cursor.start_time.isoformat()}_{cursor.id}', None))
+
+  return requests
+
+
+def sequential_scans(connection, statement, parameters):
+  # the hot tables fully scanned by the plan of one captured statement
+  if connection.dialect.name == 'postgresql':
+    plan = connection.exec_driver_sql('EXPLAIN ' + statement, parameters).scalars().all()
+    scanned = re.findall(r'Seq Scan on (\w+)', '\n'.join(plan))
+  else:
+    details = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).scalars(-1).all()
+    scanned = []
+
+    for detail in details:
+      match = re.match(r'SCAN (?:TABLE )?(\w+)', detail)
+      if match and 'USING' not in detail:
+        scanned.append(match.group(1))
+
+  return sorted(set(scanned) & set(HOT_TABLES))
+
+
+def replay_hot_paths():
+  # renders every hot path request, bypassing the page cache, and yields
+  # (endpoint, method, url, response, capture of its statements)
+  client = current_app.test_client()
+
+  for endpoint, method, url, form in hot_path_requests():
+    with QueryCapture(db.engine) as capture:
+      response = client.open(url, method=method, data=form, headers={'Cache-Control': 'no-cache'})
+      response.close()
+      # the command's app context outlives the request, so end its session
+      # here as the request teardown would
+      db.session.remove()
+
+    yield endpoint, method, url, response, capture
+
+
+@click.command('check-indexes')
+@with_appcontext
+def check_indexes_command():
+  # replays every read view against the current (seeded) database, EXPLAINs
+  # the statements they issue and fails if a hot table is scanned in full
+  failures = 0
+
+  for endpoint, method, url, response, capture in replay_hot_paths():
+
+    if response.status_code != 200:
+      raise click.ClickException(f'{method} {url} returned {response.status_code}.')
+
+    statements = [q for q in capture.queries if q.statement.lstrip().upper().startswith('SELECT')]
+
+    with db.engine.connect() as connection:
+      if connection.dialect.name == 'postgresql':
+        # make the planner prefer any usable index even on a small seed,
+        # so a remaining seq scan means there is no index to use
+        connection.exec_driver_sql('SET enable_seqscan = off')
+
+      for statement, parameters, _ in statements:
+        scanned = sequential_scans(connection, statement, parameters)
+        if scanned:
+          failures += 1
+          click.echo(f'{method} {url}: sequential scan on {", ".join(scanned)}\n  {statement}')
+
+  if failures:
+    raise click.ClickException(f'{failures} hot path statements scan a full table.')
+
+  click.echo('All hot path statements are index-backed.')
+
+
+@click.command('check-query-budget')
+@with_appcontext
+def check_query_budget_command():
+  # replays every read view and fails when one issues more statements, or
+  # fetches more rows, than its entry in QUERY_BUDGETS allows
+  failures = 0
+
+  for endpoint, method, url, response, capture in replay_hot_paths():
+
+    max_queries, max_rows = QUERY_BUDGETS[endpoint]
+    rows = capture.rows
+    click.echo(f'{method} {url}: {len(capture)} queries, {rows} rows')
+
+    if response.status_code != 200:
+      failures += 1
+      click.echo(f'  returned {response.status_code}')
+    if len(capture) > max_queries:
+      failures += 1
+      click.echo(f'  over budget: {max_queries} queries allowed')
+    if max_rows is not None and rows > max_rows:
+      failures += 1
+      click.echo(f'  over budget: {max_rows} rows allowed')
+
+  if failures:
+    raise click.ClickException(f'{failures} query budget violations.')
+
+
+@click.command('check-replicas')
+@with_appcontext
+def check_replicas_command():
+  # probes every configured replica and fails unless GET reads, plain and
+  # compound selects alike, are routed to a healthy one
+  if not router.replicas:
+    click.echo('No replicas configured.')
+    return
+
+  app = current_app._get_current_object()
+  config = app.config
+  router.refresh(app)
+  for replica in router.replicas:
+    state = 'healthy' if replica['lag'] <= config['REPLICA_MAX_LAG_SECONDS'] else 'skipped'
+    click.echo(f"{replica['bind']}: lag {replica['lag']:.1f}s, {state}")
+
+  replicas = {db.get_engine(app, bind=replica['bind']) for replica in router.replicas}
+  reads = {
+    'select': select(Venue.id),
+    'union all': union_all(select(Venue.id), select(Artist.id)),
+  }
+  failures = 0
+
+  with app.test_request_context('/venues', method='GET'):
+    for name, stmt in reads.items():
+      engine = db.session.get_bind(clause=stmt)
+      if engine in replicas:
+        click.echo(f'{name} reads from {engine.url.render_as_string(hide_password=True)}')
+      else:
+        failures += 1
+        click.echo(f'{name} reads from the primary')
+    db.session.remove()
+
+  if failures:
+    raise click.ClickException(f'{failures} reads not routed to a replica.')
+
+
+@click.command('cache-server')
+@with_appcontext
+def cache_server_command():
+  # the process behind CACHE_BACKEND = 'shared'
+  config = current_app.config
+  host, port = config['CACHE_SHARED_ADDRESS']
+  click.echo(f'Serving the shared page cache on {host}:{port}.')
+  serve_shared_cache(
+    config['CACHE_SHARED_ADDRESS'], config['CACHE_SHARED_AUTHKEY'],
+    config['CACHE_MAX_ENTRIES'], config['CACHE_MAX_BYTES']
+  )
+
+
+@click.command('import')
+@click.argument('entity', type=click.Choice(sorted(ENTITIES)))
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'format', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=IMPORT_CHUNK_SIZE, show_default=True)
+@with_appcontext
+def import_command(entity, source, format, chunk_size):
+  # flask import shows shows.csv -- rows are validated with the create
+  # forms; invalid rows are reported without stopping the load
+  format = format or ('csv' if source.name.endswith('.csv') else 'ndjson')
+  report = import_stream(entity, source, format, chunk_size).as_dict()
+
+  for error in report['errors']:
+    click.echo(f"line {error['line']}: {error['errors']}", err=True)
+
+  click.echo(
+    f"Imported {report['inserted']} {entity} ({report['failed']} failed) "
+    f"in {report['seconds']}s, {report['rows_per_second']} rows/s."
+  )
+
+
+@click.command('export')
+@click.argument('entity', type=click.Choice(sorted(EXPORTS)))
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='Defaults to stdout.')
+@click.option('--format', 'format', type=click.Choice(['csv', 'ndjson']), help='Defaults to the output extension.')
+@click.option('--since', type=click.DateTime(), help='Only rows created at or after this time.')
+@click.option('--after-id', type=int, help='Only rows with a greater id.')
+@click.option('--gzip', 'compress', is_flag=True, help='Implied by a .gz output name.')
+@with_appcontext
+def export_command(entity, output, format, since, after_id, compress):
+  name = output.name if isinstance(output.name, str) else ''
+  compress = compress or name.endswith('.gz')
+  format = format or ('csv' if name.removesuffix('.gz').endswith('.csv') else 'ndjson')
+
+  try:
+    chunks = export_chunks(entity, format, since, after_id, compress)
+  except ValueError as e:
+    raise click.ClickException(str(e))
+
+  for chunk in chunks:
+    output.write(chunk)
+
+
+@click.command('warm-templates')
+@with_appcontext
+def warm_templates_command():
+  # run on deploy, before the workers start, so none of them pays for
+  # compiling templates on its first requests
+  count, seconds = warm_templates(current_app)
+  cache_dir = current_app.config['TEMPLATE_BYTECODE_CACHE_DIR'] or 'memory only'
+  click.echo(f'Compiled {count} templates in {seconds * 1000:.0f}ms ({cache_dir}).')
+
+
+@click.command('geocode-venues')
+@click.option('--all', 'everything', is_flag=True, help='Also venues that already have coordinates.')
+@with_appcontext
+def geocode_venues_command(everything):
+  # fills venue coordinates from the bundled centroid table (no network),
+  # e.g. after the add_venue_coordinates migration
+  stmt = select(Venue.id, Venue.address, Venue.city, Venue.state)
+  if not everything:
+    stmt = stmt.where(Venue.latitude.is_(None))
+
+  located, unknown = [], 0
+  for id, address, city, state in db.session.execute(stmt).all():
+    point = geocode(address, city, state)
+    if point is None:
+      unknown += 1
+    else:
+      located.append({'venue_id': id, 'latitude': point[0], 'longitude': point[1]})
+
+  if located:
+    db.session.execute(
+      update(Venue.__table__)
+      .where(Venue.__table__.c.id == bindparam('venue_id'))
+      .values(latitude=bindparam('latitude'), longitude=bindparam('longitude')),
+      located
+    )
+    db.session.commit()
+    page_cache.invalidate('venues')
+
+  click.echo(f'Geocoded {len(located)} venues; {unknown} matched no ZIP code, city or state.')
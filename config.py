@@ -1,14 +1,149 @@
 import os
-SECRET_KEY = os.urandom(32)
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-# Enable debug mode.
-DEBUG = True
+# The environment is picked with FYYUR_ENV (development, testing or
+# production). On top of its class, FYYUR_SETTINGS may name a python file of
+# overrides, and any FYYUR_<NAME> variable sets <NAME> (values parsed as
+# JSON when they can be, e.g. FYYUR_CACHE_DEFAULT_TTL=120).
 
-# Connect to the database
 
+# Placeholder keys for local use only; production refuses to start with them
+DEVELOPMENT_SECRET_KEY = 'development-only-secret'
+TESTING_SECRET_KEY = 'testing-only-secret'
 
-# TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgresql://aminukano@localhost:5432/fyyur'
-SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+def env_flag(name, default):
+  return os.environ.get(name, str(default)).lower() == 'true'
+
+
+class Config:
+  DEBUG = False
+  TESTING = False
+  # Shared by every worker, so sessions and CSRF tokens survive a request
+  # landing on another process
+  SECRET_KEY = os.environ.get('SECRET_KEY')
+
+  # DONE IMPLEMENT DATABASE URL
+  SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql://aminukano@localhost:5432/fyyur')
+  # Optional read replicas for the reads of GET requests: comma separated URLs
+  # and, optionally, matching round-robin weights
+  SQLALCHEMY_REPLICA_URIS = [u for u in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if u]
+  SQLALCHEMY_REPLICA_WEIGHTS = [int(w) for w in os.environ.get('DATABASE_REPLICA_WEIGHTS', '').split(',') if w]
+  # Replicas lagging more than this are skipped until they catch up
+  REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+  REPLICA_LAG_CHECK_SECONDS = float(os.environ.get('REPLICA_LAG_CHECK_SECONDS', 5))
+  # A client that just wrote reads from the primary for this long
+  PRIMARY_STICKY_SECONDS = int(os.environ.get('PRIMARY_STICKY_SECONDS', 10))
+
+  # Engine pool, size it so workers * (pool size + overflow) stays under the
+  # server's max_connections
+  DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+  DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+  DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+  DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+  DB_POOL_PRE_PING = env_flag('DB_POOL_PRE_PING', True)
+  DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))
+  SQLALCHEMY_TRACK_MODIFICATIONS = False
+  SQLALCHEMY_ECHO = False
+  # Independent reads of one page run concurrently (see fanout.py), each on a
+  # pooled connection of its own, so the pool should cover the busiest pages
+  FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', 8))
+  FANOUT_TIMEOUT_SECONDS = float(os.environ.get('FANOUT_TIMEOUT_SECONDS', 5))
+  # The ASGI mode (asgi.py) reads through an asyncio engine; by default it
+  # connects to SQLALCHEMY_DATABASE_URI with the asyncpg/aiosqlite driver
+  ASYNC_DATABASE_URI = os.environ.get('ASYNC_DATABASE_URL')
+
+  # Statements slower than this are logged with their fingerprint
+  SLOW_QUERY_SECONDS = 0.2
+
+  # Largest request body, e.g. an /import upload; bigger ones get a 413
+  MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 50 * 1024 * 1024))
+
+  # Templates are compiled to bytecode in this directory (empty disables it);
+  # `flask warm-templates` fills it before workers start. Auto-reload stats
+  # every template on each render.
+  TEMPLATE_BYTECODE_CACHE_DIR = os.environ.get('TEMPLATE_BYTECODE_CACHE_DIR', os.path.join(basedir, '.jinja-cache'))
+  TEMPLATES_PRELOAD = env_flag('TEMPLATES_PRELOAD', False)
+  TEMPLATES_AUTO_RELOAD = False
+  EXPLAIN_TEMPLATE_LOADING = False
+  # {% cache %} fragments live in the page cache backend for this long
+  FRAGMENT_CACHE_TTL = 300
+
+  # Page cache: 'memory' keeps an LRU per worker, 'shared' connects to the
+  # process started with `flask cache-server`
+  CACHE_ENABLED = True
+  CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+  CACHE_DEFAULT_TTL = 60
+  CACHE_MAX_ENTRIES = 2048
+  CACHE_MAX_BYTES = 64 * 1024 * 1024
+  CACHE_SHARED_ADDRESS = ('127.0.0.1', 50000)
+  CACHE_SHARED_AUTHKEY = os.environ.get('CACHE_SHARED_AUTHKEY', 'fyyur-cache').encode()
+
+
+class DevelopmentConfig(Config):
+  # Enable debug mode.
+  DEBUG = True
+  TEMPLATES_AUTO_RELOAD = True
+  # A fixed key, so a restart or a second worker keeps sessions valid
+  SECRET_KEY = os.environ.get('SECRET_KEY', DEVELOPMENT_SECRET_KEY)
+
+
+class TestingConfig(Config):
+  TESTING = True
+  SECRET_KEY = TESTING_SECRET_KEY
+  # a file rather than :memory:, which would give each fan-out thread its
+  # own empty database
+  SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'sqlite:////tmp/fyyur-test.db')
+  SQLALCHEMY_REPLICA_URIS = []
+  WTF_CSRF_ENABLED = False
+  CACHE_ENABLED = False
+  CACHE_BACKEND = 'memory'
+  TEMPLATE_BYTECODE_CACHE_DIR = ''
+
+
+class ProductionConfig(Config):
+  # tuned for throughput: no reloading or debug hooks, templates compiled at
+  # worker start, and static files cached by browsers for a year
+  TEMPLATES_PRELOAD = env_flag('TEMPLATES_PRELOAD', True)
+  SEND_FILE_MAX_AGE_DEFAULT = 365 * 24 * 3600
+  SESSION_COOKIE_SECURE = env_flag('SESSION_COOKIE_SECURE', True)
+  PREFERRED_URL_SCHEME = 'https'
+
+
+ENVIRONMENTS = {
+  'development': DevelopmentConfig,
+  'testing': TestingConfig,
+  'production': ProductionConfig,
+}
+
+# settings a production worker refuses to start with: (check, problem)
+PRODUCTION_CHECKS = (
+  (lambda c: c['DEBUG'], 'DEBUG is on'),
+  (lambda c: c['TESTING'], 'TESTING is on'),
+  (lambda c: c['TEMPLATES_AUTO_RELOAD'], 'TEMPLATES_AUTO_RELOAD is on'),
+  (lambda c: c['EXPLAIN_TEMPLATE_LOADING'], 'EXPLAIN_TEMPLATE_LOADING is on'),
+  (lambda c: c['SQLALCHEMY_ECHO'], 'SQLALCHEMY_ECHO is on'),
+  (lambda c: not c['SECRET_KEY'], 'SECRET_KEY is not set'),
+  (lambda c: c['SECRET_KEY'] in (DEVELOPMENT_SECRET_KEY, TESTING_SECRET_KEY), 'SECRET_KEY is a development key'),
+  (
+    lambda c: c['CACHE_BACKEND'] == 'shared' and c['CACHE_SHARED_AUTHKEY'] == b'fyyur-cache',
+    'CACHE_SHARED_AUTHKEY is the default'
+  ),
+)
+
+
+def load_config(app, environment=None):
+  environment = environment or os.environ.get('FYYUR_ENV', 'development')
+  if environment not in ENVIRONMENTS:
+    raise RuntimeError(f'FYYUR_ENV must be one of {", ".join(ENVIRONMENTS)}, not {environment!r}.')
+
+  app.config.from_object(ENVIRONMENTS[environment])
+  app.config.from_envvar('FYYUR_SETTINGS', silent=True)
+  app.config.from_prefixed_env('FYYUR')
+  app.config['ENVIRONMENT'] = environment
+
+  if environment == 'production':
+    problems = [problem for check, problem in PRODUCTION_CHECKS if check(app.config)]
+    if problems:
+      raise RuntimeError('Refusing to start in production: ' + '; '.join(problems) + '.')
@@ -0,0 +1,114 @@
+import csv
+import io
+import json
+import zlib
+from sqlalchemy import select
+from models import db, Venue, Artist, Show
+from importer import ENTITIES
+
+#----------------------------------------------------------------------------#
+# Bulk export.
+#----------------------------------------------------------------------------#
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORTS = {'venues': Venue, 'artists': Artist, 'shows': Show}
+
+MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def export_columns(entity):
+  # named as the importer reads them, so an export can be imported again
+  columns = {column: field for field, column in ENTITIES[entity][2].items()}
+  return [columns.get(column.name, column.name) for column in EXPORTS[entity].__table__.columns]
+
+
+def export_stmt(model, since=None, after_id=None):
+  # incremental exports: rows created since a point in time (venues and
+  # artists carry created_at) and/or rows past the last exported id
+  stmt = select(*model.__table__.columns).order_by(model.id)
+
+  if since is not None:
+    stmt = stmt.where(model.created_at >= since)
+  if after_id is not None:
+    stmt = stmt.where(model.id > after_id)
+
+  return stmt
+
+
+def export_batches(model, since=None, after_id=None, batch_size=EXPORT_BATCH_SIZE):
+  # stream_results asks the driver for a server-side cursor (a named cursor
+  # on psycopg2), so only one batch of rows is held in memory at a time
+  result = db.session.execute(
+    export_stmt(model, since, after_id), execution_options={'stream_results': True}
+  ).yield_per(batch_size)
+
+  for batch in result.partitions():
+    yield batch
+
+
+def json_value(value):
+  return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def ndjson_chunks(columns, batches):
+  for batch in batches:
+    yield ''.join(
+      json.dumps({column: json_value(value) for column, value in zip(columns, row)}) + '\n'
+      for row in batch
+    )
+
+
+def csv_value(value):
+  # lists (genres) use the same ';' separator the importer reads, booleans
+  # the spelling it reads
+  if isinstance(value, list):
+    return ';'.join(value)
+  if isinstance(value, bool):
+    return 'true' if value else 'false'
+  return json_value(value)
+
+
+def csv_chunks(columns, batches):
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  writer.writerow(columns)
+
+  for batch in batches:
+    writer.writerows([csv_value(value) for value in row] for row in batch)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+  # the header alone, for an empty export
+  if buffer.tell():
+    yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+  # gzip framing (wbits=31) compressed chunk by chunk, never the whole body
+  compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+  for chunk in chunks:
+    data = compressor.compress(chunk.encode('utf-8'))
+    if data:
+      yield data
+
+  yield compressor.flush()
+
+
+def export_chunks(entity, format, since=None, after_id=None, compress=False):
+  # raises ValueError before streaming anything when since is given for an
+  # entity without a creation time
+  model = EXPORTS[entity]
+  if since is not None and 'created_at' not in model.__table__.columns:
+    raise ValueError(f'{entity} have no creation time to export since; use after_id.')
+
+  columns = export_columns(entity)
+  batches = export_batches(model, since, after_id)
+
+  chunks = csv_chunks(columns, batches) if format == 'csv' else ndjson_chunks(columns, batches)
+
+  if compress:
+    return gzip_chunks(chunks)
+  return (chunk.encode('utf-8') for chunk in chunks)
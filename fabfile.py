@@ -3,16 +3,24 @@ from fabric.contrib.console import confirm
 
 # prepare for deployment
 
+# the baseline in benchmarks/baseline.json was recorded against this database
+BENCHMARK_DB = "DATABASE_URL=sqlite:////tmp/fyyur-bench.db"
+
 
 def test():
+    # statements and rows per request only; latency is machine-dependent
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "{0} python benchmarks/seed.py && {0} python benchmarks/run.py --compare".format(BENCHMARK_DB)
         )
-    if result.failed and not confirm("Tests failed. Continue?"):
+    if result.failed and not confirm("Benchmarks regressed. Continue?"):
         abort("Aborted at user request.")
 
 
+def baseline():
+    local("{0} python benchmarks/seed.py && {0} python benchmarks/run.py --save-baseline".format(BENCHMARK_DB))
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -0,0 +1,116 @@
+from sqlalchemy import select, func, and_, exists, cast, literal_column, union_all, true, String
+from models import db, Venue, Artist
+
+#----------------------------------------------------------------------------#
+# Facets.
+#----------------------------------------------------------------------------#
+
+# the "looking for" flag of each listing
+SEEKING = {Venue: Venue.seeking_talent, Artist: Artist.seeking_venue}
+
+FACETS = ('genre', 'state', 'city', 'seeking')
+
+# values counted per facet, the most common first; the listings show ten
+FACET_VALUES_LIMIT = 100
+MAX_FACET_ROWS = FACET_VALUES_LIMIT * len(FACETS)
+
+
+def facet_filters(args):
+  # ?genre=Jazz&genre=Blues&state=CA&city=...&seeking=true, every part optional.
+  # several genres narrow the listing to rows having all of them.
+  seeking = args.get('seeking', '').lower()
+  return {
+    'genres': [genre for genre in args.getlist('genre') if genre],
+    'state': args.get('state') or None,
+    'city': args.get('city') or None,
+    'seeking': {'true': True, 'false': False}.get(seeking),
+  }
+
+
+def filtering(filters):
+  return bool(filters) and any(value not in (None, []) for value in filters.values())
+
+
+def has_genres(column, genres):
+  # genres is varchar[] with a GIN index on Postgres, where @> uses the
+  # index; SQLite stores JSON and goes through json_each
+  if db.engine.dialect.name == 'postgresql':
+    return column.contains(genres)
+
+  return and_(*(
+    exists(select(literal_column('1')).select_from(func.json_each(column)).where(literal_column('value') == genre))
+    for genre in genres
+  ))
+
+
+def apply_facets(stmt, model, filters):
+  if not filtering(filters):
+    return stmt
+
+  if filters['genres']:
+    stmt = stmt.where(has_genres(model.genres, filters['genres']))
+  if filters['state']:
+    stmt = stmt.where(model.state == filters['state'])
+  if filters['city']:
+    stmt = stmt.where(model.city == filters['city'])
+  if filters['seeking'] is not None:
+    stmt = stmt.where(SEEKING[model] == filters['seeking'])
+
+  return stmt
+
+
+def unnest_genres(column):
+  # (table to join, its genre column)
+  if db.engine.dialect.name == 'postgresql':
+    genres = func.unnest(column).table_valued('genre').render_derived('genres')
+    return genres, genres.c.genre
+  genres = func.json_each(column).table_valued('value')
+  return genres, genres.c.value
+
+
+def facet_counts_stmt(model, filters=None):
+  # every facet's value counts over the filtered listing, in one statement:
+  # one GROUP BY per facet, glued together with UNION ALL. at most
+  # MAX_FACET_ROWS rows.
+  filtered = apply_facets(
+    select(model.genres, model.state, model.city, SEEKING[model].label('seeking')), model, filters
+  ).cte('filtered')
+  genres, genre = unnest_genres(filtered.c.genres)
+
+  def grouped(facet, value, source=filtered):
+    counts = (
+      select(literal_column(f"'{facet}'").label('facet'), cast(value, String).label('value'), func.count().label('count'))
+      .select_from(source)
+      .group_by(value)
+      .order_by(func.count().desc(), value)
+      .limit(FACET_VALUES_LIMIT)
+    )
+    # a subquery, since sqlite refuses LIMIT on the parts of a compound select
+    return select(counts.subquery())
+
+  return union_all(
+    grouped('genre', genre, filtered.join(genres, true())),
+    grouped('state', filtered.c.state),
+    grouped('city', filtered.c.city),
+    grouped('seeking', filtered.c.seeking),
+  )
+
+
+def group_facets(rows):
+  # {facet: [(value, count), ...]} with the most common values first
+  counts = {facet: [] for facet in FACETS}
+
+  for facet, value, count in rows:
+    if facet == 'seeking':
+      # booleans come back as 'true'/'false' on Postgres and '1'/'0' on SQLite
+      value = 'true' if value in ('true', '1') else 'false'
+    counts[facet].append((value, count))
+
+  for values in counts.values():
+    values.sort(key=lambda item: (-item[1], item[0]))
+
+  return counts
+
+
+def facet_counts(model, filters=None):
+  return group_facets(db.session.execute(facet_counts_stmt(model, filters)))
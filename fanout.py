@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock
+from flask import copy_current_request_context, current_app, g, has_request_context
+
+#----------------------------------------------------------------------------#
+# Concurrent reads.
+#----------------------------------------------------------------------------#
+
+executor = None
+executor_lock = Lock()
+
+
+def get_executor(app):
+  global executor
+  with executor_lock:
+    if executor is None:
+      executor = ThreadPoolExecutor(app.config['FANOUT_WORKERS'], thread_name_prefix='fanout')
+  return executor
+
+
+def fan_out(queries, optional=(), timeout=None):
+  # runs independent reads for one page at the same time, each in a pool
+  # thread with its own session (and so its own pooled connection):
+  #
+  #   results = fan_out({'venue': load_venue, 'timeline': load_timeline})
+  #
+  # a failing or timed out query raises, unless it is named in optional, in
+  # which case its result is None and the page renders without it.
+  if not has_request_context():
+    return {name: query() for name, query in queries.items()}
+
+  app = current_app._get_current_object()
+  timeout = app.config['FANOUT_TIMEOUT_SECONDS'] if timeout is None else timeout
+  # the copied request context gets a fresh g; carry over the replica this
+  # request reads from and its query timings
+  shared = {name: g.get(name) for name in ('read_bind', 'timings') if name in g}
+
+  def run(query):
+    for name, value in shared.items():
+      setattr(g, name, value)
+    return query()
+
+  pool = get_executor(app)
+  futures = {name: pool.submit(copy_current_request_context(run), query) for name, query in queries.items()}
+  done, _ = wait(futures.values(), timeout=timeout)
+  results = {}
+
+  for name, future in futures.items():
+    if future in done:
+      error = future.exception()
+    else:
+      # a statement already sent can't be recalled; DB_STATEMENT_TIMEOUT_MS
+      # bounds how long it keeps its connection
+      future.cancel()
+      error = TimeoutError(f'{name} did not finish within {timeout}s')
+
+    if error is None:
+      results[name] = future.result()
+    elif name in optional:
+      app.logger.warning('optional query %s failed: %r', name, error)
+      results[name] = None
+    else:
+      raise error
+
+  return results
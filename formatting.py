@@ -0,0 +1,51 @@
+from functools import lru_cache
+import dateutil.parser
+from babel import Locale
+from babel.dates import UTC, format_datetime as babel_format_datetime, parse_pattern
+
+#----------------------------------------------------------------------------#
+# Date formatting.
+#----------------------------------------------------------------------------#
+
+DEFAULT_LOCALE = 'en'
+MEMO_SIZE = 8192
+
+# the app's own names for its display patterns
+PATTERNS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+# babel's named formats are looked up per locale, so they keep going
+# through babel.dates.format_datetime
+BABEL_FORMATS = ('long', 'short')
+
+
+@lru_cache(maxsize=None)
+def compiled(format, locale):
+  # parsing a pattern and loading locale data are the expensive parts of
+  # babel's format_datetime; both only depend on (format, locale)
+  return parse_pattern(PATTERNS.get(format, format)), Locale.parse(locale)
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def format_datetime(value, format='medium', locale=DEFAULT_LOCALE):
+  # memoized: listings repeat the same timestamps (and filters run once per
+  # row), so repeated values cost a dict lookup
+  date = dateutil.parser.parse(value) if isinstance(value, str) else value
+
+  if format in BABEL_FORMATS:
+    return babel_format_datetime(date, format, locale=locale)
+
+  # babel treats naive datetimes as UTC
+  if date.tzinfo is None:
+    date = date.replace(tzinfo=UTC)
+
+  pattern, locale = compiled(format, locale)
+  return pattern.apply(date, locale)
+
+
+def format_datetimes(values, format='medium', locale=DEFAULT_LOCALE):
+  # a whole column at once: each distinct value is formatted a single time
+  formatted = {value: format_datetime(value, format, locale) for value in set(values)}
+  return [formatted[value] for value in values]
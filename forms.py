@@ -1,7 +1,11 @@
 from datetime import datetime
 from flask_wtf import FlaskForm
 from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL, Regexp
+from wtforms.validators import DataRequired, AnyOf, URL, Regexp, Optional, ValidationError
+from models import MAX_SHOW_DURATION
+
+# the form's own spelling first, then the ISO one exports and the API write
+SHOW_TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S']
 
 class ShowForm(FlaskForm):
     artist_id = StringField(
@@ -13,8 +17,21 @@ class ShowForm(FlaskForm):
     start_time = DateTimeField(
         'start_time',
         validators=[DataRequired()],
+        format=SHOW_TIME_FORMATS,
         default= datetime.today()
     )
+    # optional: shows without one are booked for DEFAULT_SHOW_DURATION
+    end_time = DateTimeField(
+        'end_time',
+        validators=[Optional()],
+        format=SHOW_TIME_FORMATS
+    )
+
+    def validate_end_time(form, field):
+        if field.data and form.start_time.data and field.data <= form.start_time.data:
+            raise ValidationError('The end time must be after the start time.')
+        if field.data and form.start_time.data and field.data - form.start_time.data > MAX_SHOW_DURATION:
+            raise ValidationError(f'A show can run for at most {MAX_SHOW_DURATION.days} days.')
 
 class VenueForm(FlaskForm):
     name = StringField(
@@ -0,0 +1,50 @@
+import csv
+import os
+import re
+from functools import lru_cache
+
+#----------------------------------------------------------------------------#
+# Offline geocoding.
+#----------------------------------------------------------------------------#
+
+# ZIP code, 'City, ST' and state centroids; more rows (e.g. a full ZIP table)
+# can be appended in the same key,latitude,longitude form
+CENTROIDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'centroids.csv')
+
+ZIP_CODE_RE = re.compile(r'\b(\d{5})(?:-\d{4})?\s*$')
+
+
+def normalize(text):
+  # 'St. Louis,  MO' and 'st louis, mo' are the same key
+  return ', '.join(' '.join(part.replace('.', '').split()) for part in text.lower().split(','))
+
+
+@lru_cache(maxsize=1)
+def centroids():
+  with open(CENTROIDS_PATH, newline='') as f:
+    return {normalize(row['key']): (float(row['latitude']), float(row['longitude'])) for row in csv.DictReader(f)}
+
+
+def geocode(address=None, city=None, state=None):
+  # the most precise centroid known for a venue: its address's ZIP code, then
+  # its city, then its state. (latitude, longitude) or None.
+  table = centroids()
+  keys = []
+
+  zip_code = ZIP_CODE_RE.search(address or '')
+  if zip_code:
+    keys.append(zip_code.group(1))
+  if city and state:
+    keys.append(normalize(f'{city}, {state}'))
+  if state:
+    keys.append(normalize(state))
+
+  for key in keys:
+    if key in table:
+      return table[key]
+  return None
+
+
+def geocode_place(text):
+  # what a visitor types to search near: '94103', 'San Francisco, CA' or 'CA'
+  return centroids().get(normalize(text))
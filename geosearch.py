@@ -0,0 +1,205 @@
+import heapq
+import math
+from threading import Lock
+from sqlalchemy import select, func, inspect
+from models import db, Venue
+from geocoding import geocode, geocode_place
+from projections import projection, projected, project
+
+#----------------------------------------------------------------------------#
+# Venues near a place.
+#----------------------------------------------------------------------------#
+
+EARTH_RADIUS_KM = 6371.0088
+NEARBY_LIMIT = 20
+NEARBY_MAX_LIMIT = 100
+
+NearbyVenue = projection(
+  'NearbyVenue',
+  id=Venue.id,
+  name=Venue.name,
+  city=Venue.city,
+  state=Venue.state,
+  num_upcoming_shows=Venue.upcoming_shows_count
+)
+
+
+def fill_coordinates(mapper, connection, target):
+  # geocodes a venue whose address changed, unless its coordinates were set
+  # explicitly in the same change
+  state = inspect(target)
+  if state.attrs.latitude.history.has_changes() or state.attrs.longitude.history.has_changes():
+    return
+
+  moved = any(state.attrs[name].history.has_changes() for name in ('address', 'city', 'state'))
+  if moved or target.latitude is None:
+    target.latitude, target.longitude = geocode(target.address, target.city, target.state) or (None, None)
+
+
+for event in ('before_insert', 'before_update'):
+  db.event.listen(Venue, event, fill_coordinates)
+
+
+def nearby_params(args):
+  # ?near=94103|San Francisco, CA or ?lat=..&lon=.., plus optional
+  # radius_km and limit. (latitude, longitude, radius_km, limit); raises
+  # ValueError with a message for the visitor.
+  if args.get('near'):
+    point = geocode_place(args['near'])
+    if point is None:
+      raise ValueError(f"Unknown place {args['near']!r}; try a ZIP code or 'City, ST'.")
+  else:
+    point = (args.get('lat', type=float), args.get('lon', type=float))
+    if None in point or not (-90 <= point[0] <= 90 and -180 <= point[1] <= 180):
+      raise ValueError('Pass near, or lat and lon in degrees.')
+
+  radius = args.get('radius_km', type=float)
+  if radius is not None and radius <= 0:
+    raise ValueError('radius_km must be positive.')
+  limit = min(max(args.get('limit', NEARBY_LIMIT, type=int), 1), NEARBY_MAX_LIMIT)
+
+  return point[0], point[1], radius, limit
+
+
+#  Postgres
+#  ----------------------------------------------------------------
+
+def postgres_nearby_stmt(latitude, longitude, radius_km, limit):
+  # earthdistance on the gist index of the add_venue_coordinates migration:
+  # earth_box narrows a radius search, <-> walks the index nearest first
+  point = func.ll_to_earth(latitude, longitude)
+  location = func.ll_to_earth(Venue.latitude, Venue.longitude)
+  distance = func.earth_distance(location, point)
+
+  stmt = projected(NearbyVenue, (distance / 1000).label('distance_km')).where(Venue.latitude.isnot(None))
+  if radius_km is not None:
+    stmt = stmt.where(func.earth_box(point, radius_km * 1000).op('@>')(location), distance <= radius_km * 1000)
+
+  return stmt.order_by(location.op('<->')(point)).limit(limit)
+
+
+def postgres_nearby(latitude, longitude, radius_km, limit):
+  rows = db.session.execute(postgres_nearby_stmt(latitude, longitude, radius_km, limit)).all()
+  return [(venue, row.distance_km) for venue, row in zip(project(NearbyVenue, rows), rows)]
+
+
+#  In-process KD-tree
+#  ----------------------------------------------------------------
+#  SQLite has no spatial index, so tests fall back to a k-d tree over points
+#  on the unit sphere, where straight-line (chord) distance orders venues
+#  like distance over the earth's surface. rebuilt lazily after venue writes.
+
+def unit_vector(latitude, longitude):
+  latitude, longitude = math.radians(latitude), math.radians(longitude)
+  return (
+    math.cos(latitude) * math.cos(longitude),
+    math.cos(latitude) * math.sin(longitude),
+    math.sin(latitude)
+  )
+
+
+def chord_to_km(chord):
+  return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+
+def km_to_chord(km):
+  return 2 * math.sin(min(km / (2 * EARTH_RADIUS_KM), math.pi / 2))
+
+
+class KDTree:
+
+  def __init__(self, points):
+    # points: [(unit vector, id)]. nodes are (vector, id, axis, left, right)
+    self.root = self.build(list(points), 0)
+
+  def build(self, points, axis):
+    if not points:
+      return None
+
+    points.sort(key=lambda point: point[0][axis])
+    middle = len(points) // 2
+    vector, id = points[middle]
+    following = (axis + 1) % 3
+    return (vector, id, axis, self.build(points[:middle], following), self.build(points[middle + 1:], following))
+
+  def nearest(self, target, limit, max_chord=2.0):
+    # [(chord, id)] of up to limit points within max_chord, nearest first
+    found = []  # max-heap of (-squared chord, id)
+    max_squared = max_chord * max_chord
+    tx, ty, tz = target
+
+    def bound():
+      return -found[0][0] if len(found) == limit else max_squared
+
+    def visit(node):
+      if node is None:
+        return
+      (x, y, z), id, axis, left, right = node
+
+      squared = (x - tx) ** 2 + (y - ty) ** 2 + (z - tz) ** 2
+      if squared <= bound():
+        if len(found) == limit:
+          heapq.heapreplace(found, (-squared, id))
+        else:
+          heapq.heappush(found, (-squared, id))
+
+      offset = target[axis] - node[0][axis]
+      near, far = (left, right) if offset < 0 else (right, left)
+      visit(near)
+      if offset * offset <= bound():
+        visit(far)
+
+    visit(self.root)
+    return sorted((math.sqrt(-squared), id) for squared, id in found)
+
+
+class LocationIndex:
+
+  def __init__(self):
+    self.stale = True
+    self.lock = Lock()
+    self.tree = KDTree([])
+
+  def rebuild(self):
+    rows = db.session.execute(
+      select(Venue.id, Venue.latitude, Venue.longitude).where(Venue.latitude.isnot(None))
+    )
+    self.tree = KDTree((unit_vector(latitude, longitude), id) for id, latitude, longitude in rows)
+    self.stale = False
+
+  def nearest(self, latitude, longitude, radius_km, limit):
+    with self.lock:
+      if self.stale:
+        self.rebuild()
+
+    max_chord = km_to_chord(radius_km) if radius_km is not None else 2.0
+    return self.tree.nearest(unit_vector(latitude, longitude), limit, max_chord)
+
+
+locations = LocationIndex()
+
+
+def mark_stale(mapper, connection, target):
+  locations.stale = True
+
+
+for event in ('after_insert', 'after_update', 'after_delete'):
+  db.event.listen(Venue, event, mark_stale)
+
+
+def in_process_nearby(latitude, longitude, radius_km, limit):
+  matches = locations.nearest(latitude, longitude, radius_km, limit)
+  if not matches:
+    return []
+
+  rows = db.session.execute(projected(NearbyVenue).where(Venue.id.in_([id for _, id in matches]))).all()
+  venues = {venue.id: venue for venue in project(NearbyVenue, rows)}
+
+  return [(venues[id], chord_to_km(chord)) for chord, id in matches if id in venues]
+
+
+def nearby_venues(latitude, longitude, radius_km=None, limit=NEARBY_LIMIT):
+  # [(NearbyVenue, distance in km)], nearest first
+  if db.engine.dialect.name == 'postgresql':
+    return postgres_nearby(latitude, longitude, radius_km, limit)
+  return in_process_nearby(latitude, longitude, radius_km, limit)
@@ -0,0 +1,241 @@
+import csv
+import io
+import json
+from functools import lru_cache
+from itertools import islice
+from time import perf_counter
+from sqlalchemy import select, insert
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.datastructures import MultiDict
+from wtforms import BooleanField
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Venue, Artist, Show, refresh_show_counters
+from scheduling import with_end_time, availability, batch_conflicts, describe_conflict
+from cache import page_cache
+import search
+import geosearch
+from geocoding import geocode
+
+#----------------------------------------------------------------------------#
+# Bulk import.
+#----------------------------------------------------------------------------#
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+# how CSV files spell a false boolean; BooleanField itself only treats
+# 'false' and '' as false, everything else would import as True
+FALSE_STRINGS = ('', 'false', 'f', 'no', 'n', '0', 'off')
+
+# entity: (model, form, {form field: column}) -- only the fields whose
+# column name differs from the form field need mapping
+ENTITIES = {
+  'venues': (Venue, VenueForm, {'website_link': 'website'}),
+  'artists': (Artist, ArtistForm, {'website_link': 'website'}),
+  'shows': (Show, ShowForm, {}),
+}
+
+
+class ImportReport:
+
+  def __init__(self, entity):
+    self.entity = entity
+    self.inserted = 0
+    self.failed = 0
+    self.errors = []
+    self.started = perf_counter()
+
+  def error(self, line, message):
+    self.failed += 1
+    if len(self.errors) < MAX_REPORTED_ERRORS:
+      self.errors.append({'line': line, 'errors': message})
+
+  def as_dict(self):
+    elapsed = perf_counter() - self.started
+    return {
+      'entity': self.entity,
+      'inserted': self.inserted,
+      'failed': self.failed,
+      'seconds': round(elapsed, 3),
+      'rows_per_second': round(self.inserted / elapsed, 1) if elapsed else None,
+      'errors': self.errors,
+    }
+
+
+def read_rows(stream, format):
+  # yields (line number, row dict) from a binary stream, one line at a time.
+  # CSV list fields (genres) are separated by ';'.
+  text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+  if format == 'csv':
+    reader = csv.DictReader(text)
+    for row in reader:
+      yield reader.line_num, row
+  else:
+    for line, raw in enumerate(text, start=1):
+      if raw.strip():
+        try:
+          yield line, json.loads(raw)
+        except ValueError as e:
+          yield line, e
+
+
+@lru_cache(maxsize=None)
+def boolean_fields(form_class):
+  return {
+    name for name in dir(form_class)
+    if getattr(getattr(form_class, name), 'field_class', None) is BooleanField
+  }
+
+
+def form_data(row, booleans=()):
+  data = MultiDict()
+
+  for field, value in row.items():
+    if value is None:
+      continue
+    if field in booleans and isinstance(value, str):
+      # a false value is an absent checkbox
+      value = value.strip().lower() not in FALSE_STRINGS
+    if isinstance(value, str) and field == 'genres':
+      value = [genre.strip() for genre in value.split(';') if genre.strip()]
+    if isinstance(value, list):
+      for item in value:
+        data.add(field, str(item))
+    elif isinstance(value, bool):
+      if value:
+        data.add(field, 'y')
+    else:
+      data.add(field, str(value))
+
+  return data
+
+
+def validate(form_class, mapping, row):
+  # the same rules as the create forms; returns (values, None) or (None, errors)
+  form = form_class(formdata=form_data(row, boolean_fields(form_class)), meta={'csrf': False})
+
+  if not form.validate():
+    return None, form.errors
+
+  values = {mapping.get(name, name): field.data for name, field in form._fields.items()}
+
+  if form_class is ShowForm:
+    try:
+      values['venue_id'], values['artist_id'] = int(values['venue_id']), int(values['artist_id'])
+    except ValueError:
+      return None, {'venue_id': ['IDs must be integers.'], 'artist_id': ['IDs must be integers.']}
+    with_end_time(values)
+
+  return values, None
+
+
+def missing_references(values):
+  # shows reference venues and artists; check a whole chunk in two queries
+  venue_ids = {v['venue_id'] for v in values}
+  artist_ids = {v['artist_id'] for v in values}
+  venues = set(db.session.scalars(select(Venue.id).where(Venue.id.in_(venue_ids))))
+  artists = set(db.session.scalars(select(Artist.id).where(Artist.id.in_(artist_ids))))
+  return venue_ids - venues, artist_ids - artists
+
+
+def insert_chunk(model, chunk, report):
+  # chunk: [(line, values)]. one transaction, one executemany per chunk.
+  if model is Show:
+    missing_venues, missing_artists = missing_references([v for _, v in chunk])
+    valid = []
+    for line, values in chunk:
+      if values['venue_id'] in missing_venues:
+        report.error(line, {'venue_id': ['No such venue.']})
+      elif values['artist_id'] in missing_artists:
+        report.error(line, {'artist_id': ['No such artist.']})
+      else:
+        valid.append((line, values))
+
+    # and no show may overlap one already booked, checked in one query,
+    available = []
+    for (line, values), result in zip(valid, availability([values for _, values in valid])):
+      if result['available']:
+        available.append((line, values))
+      else:
+        report.error(line, {'start_time': [describe_conflict(c) for c in result['conflicts']]})
+
+    # or another one of the same chunk
+    chunk = []
+    for (line, values), conflict in zip(available, batch_conflicts([values for _, values in available])):
+      if conflict is None:
+        chunk.append((line, values))
+      else:
+        other, owner = conflict
+        where = 'at the same venue' if owner == 'venue' else 'with the same artist'
+        report.error(line, {'start_time': [f'Overlaps the show on line {available[other][0]} {where}.']})
+
+  if not chunk:
+    return
+
+  rows = [values for _, values in chunk]
+  if model is Venue:
+    # core inserts skip the ORM event that geocodes venues
+    for values in rows:
+      values['latitude'], values['longitude'] = geocode(values['address'], values['city'], values['state']) or (None, None)
+
+  try:
+    db.session.execute(insert(model.__table__), rows)
+    if model is Show:
+      # core inserts skip the ORM flush events that maintain the counters
+      venue_ids = {r['venue_id'] for r in rows}
+      artist_ids = {r['artist_id'] for r in rows}
+      connection = db.session.connection()
+      refresh_show_counters(connection, Venue, venue_ids)
+      refresh_show_counters(connection, Artist, artist_ids)
+    db.session.commit()
+    report.inserted += len(rows)
+
+    if model is Show:
+      page_cache.invalidate(
+        *(f'venue:{id}' for id in venue_ids), *(f'artist:{id}' for id in artist_ids)
+      )
+  except SQLAlchemyError as e:
+    db.session.rollback()
+    for line, _ in chunk:
+      report.error(line, {'database': [str(e.orig if hasattr(e, 'orig') else e)]})
+
+
+def import_rows(entity, rows, chunk_size=IMPORT_CHUNK_SIZE):
+  # rows: iterable of (line, row dict). memory stays bounded by chunk_size.
+  model, form_class, mapping = ENTITIES[entity]
+  report = ImportReport(entity)
+  rows = iter(rows)
+
+  while True:
+    batch = list(islice(rows, chunk_size))
+    if not batch:
+      break
+
+    chunk = []
+    for line, row in batch:
+      if not isinstance(row, dict):
+        report.error(line, {'row': [str(row)]})
+        continue
+      values, errors = validate(form_class, mapping, row)
+      if errors:
+        report.error(line, errors)
+      else:
+        chunk.append((line, values))
+
+    insert_chunk(model, chunk, report)
+
+  if report.inserted:
+    page_cache.invalidate(entity)
+    if model is Show:
+      page_cache.invalidate('venues')
+    else:
+      search.indexes[model].stale = True
+    if model is Venue:
+      geosearch.locations.stale = True
+
+  return report
+
+
+def import_stream(entity, stream, format, chunk_size=IMPORT_CHUNK_SIZE):
+  return import_rows(entity, read_rows(stream, format), chunk_size)
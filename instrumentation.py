@@ -0,0 +1,272 @@
+import re
+import hashlib
+from collections import namedtuple, defaultdict
+from threading import Lock
+from time import perf_counter
+from flask import Response, current_app, g, request, has_request_context, has_app_context
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#----------------------------------------------------------------------------#
+# Query capture.
+#----------------------------------------------------------------------------#
+
+CapturedQuery = namedtuple('CapturedQuery', 'statement parameters cursor')
+
+
+class CountingCursor:
+  # stands in for the DBAPI cursor behind a result and counts the rows
+  # fetched through it; driver rowcounts can't be used for this, sqlite3
+  # reports -1 for every SELECT
+
+  def __init__(self, cursor):
+    self.cursor = cursor
+    self.fetched = 0
+
+  def fetchone(self):
+    row = self.cursor.fetchone()
+    if row is not None:
+      self.fetched += 1
+    return row
+
+  def fetchmany(self, *args):
+    rows = self.cursor.fetchmany(*args)
+    self.fetched += len(rows)
+    return rows
+
+  def fetchall(self):
+    rows = self.cursor.fetchall()
+    self.fetched += len(rows)
+    return rows
+
+  def __getattr__(self, name):
+    return getattr(self.cursor, name)
+
+
+class QueryCapture:
+  # records every statement sent to the database while the block is active:
+  #
+  #   with QueryCapture(db.engine) as capture:
+  #     client.get('/venues')
+  #   capture.queries  ->  [CapturedQuery(statement, parameters, cursor), ...]
+  #   capture.rows     ->  rows fetched by all of them
+
+  def __init__(self, engine):
+    self.engine = engine
+    self.queries = []
+
+  def record(self, conn, cursor, statement, parameters, context, executemany):
+    if context is not None and context.cursor is cursor:
+      # the result is built from context.cursor once this hook returns
+      cursor = context.cursor = CountingCursor(cursor)
+    self.queries.append(CapturedQuery(statement, parameters, cursor))
+
+  def clear(self):
+    self.queries.clear()
+
+  @property
+  def rows(self):
+    return sum(getattr(query.cursor, 'fetched', 0) for query in self.queries)
+
+  def __len__(self):
+    return len(self.queries)
+
+  def __enter__(self):
+    event.listen(self.engine, 'after_cursor_execute', self.record)
+    return self
+
+  def __exit__(self, *exc_info):
+    event.remove(self.engine, 'after_cursor_execute', self.record)
+
+
+#----------------------------------------------------------------------------#
+# Request metrics.
+#----------------------------------------------------------------------------#
+
+# per-process: each worker exposes its own /_metrics, which is what
+# prometheus expects when it scrapes workers individually
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SQL_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+SQL_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+SQL_IN_LIST_RE = re.compile(r'\bIN\s*\((?:\s*[?%][^,)]*,?)+\)', re.IGNORECASE)
+SQL_SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(statement):
+  # literals and bind lists collapsed, so every execution of the same query
+  # shape maps onto the same normalized text and short hash
+  normalized = SQL_STRING_RE.sub('?', statement)
+  normalized = SQL_NUMBER_RE.sub('?', normalized)
+  normalized = SQL_IN_LIST_RE.sub('IN (...)', normalized)
+  normalized = SQL_SPACE_RE.sub(' ', normalized).strip()
+  return hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized
+
+
+# (family, EndpointStats attribute, value format)
+COUNTER_FAMILIES = (
+  ('fyyur_requests_total', 'requests', 'd'),
+  ('fyyur_db_queries_total', 'queries', 'd'),
+  ('fyyur_db_seconds_total', 'db_seconds', '.6f'),
+  ('fyyur_template_seconds_total', 'template_seconds', '.6f'),
+)
+
+
+class EndpointStats:
+
+  def __init__(self):
+    self.requests = 0
+    self.queries = 0
+    self.db_seconds = 0.0
+    self.template_seconds = 0.0
+    self.total_seconds = 0.0
+    self.buckets = [0] * len(LATENCY_BUCKETS)
+
+
+class MetricsRegistry:
+
+  def __init__(self):
+    self.lock = Lock()
+    self.endpoints = defaultdict(EndpointStats)
+    self.collectors = []
+
+  def observe(self, endpoint, queries, db_seconds, template_seconds, total_seconds):
+    with self.lock:
+      stats = self.endpoints[endpoint]
+      stats.requests += 1
+      stats.queries += queries
+      stats.db_seconds += db_seconds
+      stats.template_seconds += template_seconds
+      stats.total_seconds += total_seconds
+      for i, bound in enumerate(LATENCY_BUCKETS):
+        if total_seconds <= bound:
+          stats.buckets[i] += 1
+
+  def add_collector(self, collector):
+    # collector() returns extra exposition lines, e.g. pool gauges, with
+    # each of its families grouped
+    self.collectors.append(collector)
+
+  def render(self):
+    # the text format wants each family's TYPE line and samples together
+    lines = []
+
+    with self.lock:
+      endpoints = [(f'endpoint="{endpoint}"', stats) for endpoint, stats in sorted(self.endpoints.items())]
+
+      for name, attribute, spec in COUNTER_FAMILIES:
+        lines.append(f'# TYPE {name} counter')
+        lines.extend(f'{name}{{{label}}} {getattr(stats, attribute):{spec}}' for label, stats in endpoints)
+
+      lines.append('# TYPE fyyur_request_duration_seconds histogram')
+      for label, stats in endpoints:
+        for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+          lines.append(f'fyyur_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'fyyur_request_duration_seconds_bucket{{{label},le="+Inf"}} {stats.requests}')
+        lines.append(f'fyyur_request_duration_seconds_sum{{{label}}} {stats.total_seconds:.6f}')
+        lines.append(f'fyyur_request_duration_seconds_count{{{label}}} {stats.requests}')
+
+    for collector in self.collectors:
+      lines.extend(collector())
+
+    return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+
+def request_timings():
+  # the running totals of the current request, None outside of one
+  if not has_request_context():
+    return None
+  if 'timings' not in g:
+    g.timings = {'queries': 0, 'db': 0.0, 'template': 0.0}
+  return g.timings
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  # statements outside an app context (scripts, background threads) are not
+  # timed: neither the request totals nor the slow query threshold exist there
+  if has_app_context():
+    conn.info.setdefault('query_start', []).append(perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  if not has_app_context() or not conn.info.get('query_start'):
+    return
+  elapsed = perf_counter() - conn.info['query_start'].pop()
+  timings = request_timings()
+
+  if timings is not None:
+    timings['queries'] += 1
+    timings['db'] += elapsed
+
+  if elapsed >= current_app.config.get('SLOW_QUERY_SECONDS', 0.2):
+    digest, normalized = fingerprint(statement)
+    current_app.logger.warning(
+      'slow query %s %.1fms [%s]: %s',
+      digest, elapsed * 1000, request.endpoint if has_request_context() else '-', normalized
+    )
+
+
+class TimedTemplate(Template):
+  # template render time per request. extends/include run inside the outer
+  # render, so only the top-level render or stream is measured.
+
+  def render(self, *args, **kwargs):
+    start = perf_counter()
+    try:
+      return super().render(*args, **kwargs)
+    finally:
+      add_template_time(perf_counter() - start)
+
+  def generate(self, *args, **kwargs):
+    chunks = super().generate(*args, **kwargs)
+    while True:
+      start = perf_counter()
+      try:
+        chunk = next(chunks)
+      except StopIteration:
+        add_template_time(perf_counter() - start)
+        return
+      add_template_time(perf_counter() - start)
+      yield chunk
+
+
+def add_template_time(seconds):
+  timings = request_timings()
+  if timings is not None:
+    timings['template'] += seconds
+
+
+def init_metrics(app):
+  app.jinja_env.template_class = TimedTemplate
+  event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+  event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+  @app.before_request
+  def start_request_timer():
+    g.request_start = perf_counter()
+    request_timings()
+
+  @app.after_request
+  def record_request_metrics(response):
+    timings = request_timings()
+    total = perf_counter() - g.get('request_start', perf_counter())
+
+    # streamed bodies are still rendering at this point, so their template
+    # and total times only cover what has happened so far
+    response.headers['Server-Timing'] = ', '.join((
+      f'db;dur={timings["db"] * 1000:.1f};desc="{timings["queries"]} queries"',
+      f'tpl;dur={timings["template"] * 1000:.1f}',
+      f'total;dur={total * 1000:.1f}',
+    ))
+    metrics.observe(
+      request.endpoint or 'unmatched', timings['queries'], timings['db'], timings['template'], total
+    )
+    return response
+
+  @app.route('/_metrics')
+  def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
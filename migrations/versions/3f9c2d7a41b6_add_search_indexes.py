@@ -0,0 +1,46 @@
+"""add search vectors and trigram indexes
+
+Revision ID: 3f9c2d7a41b6
+Revises: 01a6287eed24
+Create Date: 2026-10-17 10:12:41.208113
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2d7a41b6'
+down_revision = '01a6287eed24'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('venues', 'artists')
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    for table in TABLES:
+        # generated column, kept current by postgres on every insert/update
+        op.execute(f"""
+            ALTER TABLE {table} ADD COLUMN search_vector tsvector
+            GENERATED ALWAYS AS (
+                to_tsvector('simple', name || ' ' || city || ' ' || state)
+            ) STORED
+        """)
+        op.execute(
+            f'CREATE INDEX ix_{table}_search_vector ON {table} USING gin (search_vector)'
+        )
+        # same expression as search.search_document()
+        op.execute(f"""
+            CREATE INDEX ix_{table}_search_document_trgm ON {table}
+            USING gin ((name || ' ' || city || ' ' || state) gin_trgm_ops)
+        """)
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_search_document_trgm', table_name=table)
+        op.drop_index(f'ix_{table}_search_vector', table_name=table)
+        op.drop_column(table, 'search_vector')
@@ -0,0 +1,50 @@
+"""store artist genres as an array, index genres and areas for facets
+
+Revision ID: 5b7e2f4c8d13
+Revises: c47d09e6f215
+Create Date: 2026-10-17 16:21:09.518347
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2f4c8d13'
+down_revision = 'c47d09e6f215'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('venues', 'artists')
+
+
+def upgrade():
+    # artists.genres was created as varchar, so lists were stored as their
+    # array literal ('{Jazz,Blues}'), or comma separated by hand
+    op.execute("""
+        ALTER TABLE artists ALTER COLUMN genres TYPE varchar[] USING CASE
+            WHEN btrim(genres) = '' THEN '{}'::varchar[]
+            WHEN genres LIKE '{%}' THEN genres::varchar[]
+            ELSE string_to_array(genres, ',')::varchar[]
+        END
+    """)
+
+    for table in TABLES:
+        # trimmed, without blanks or duplicates, so facet counts add up
+        op.execute(f"""
+            UPDATE {table} SET genres = ARRAY(
+                SELECT DISTINCT btrim(genre) FROM unnest(genres) AS genre
+                WHERE btrim(genre) <> '' ORDER BY 1
+            )::varchar[]
+        """)
+        op.create_index(f'ix_{table}_genres', table, ['genres'], unique=False, postgresql_using='gin')
+
+    op.create_index('ix_artists_area', 'artists', ['state', 'city', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_artists_area', table_name='artists')
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_genres', table_name=table)
+
+    op.execute('ALTER TABLE artists ALTER COLUMN genres TYPE varchar(120) USING genres::varchar(120)')
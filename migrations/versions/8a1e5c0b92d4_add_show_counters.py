@@ -0,0 +1,56 @@
+"""add denormalized show counters to venues and artists
+
+Revision ID: 8a1e5c0b92d4
+Revises: 3f9c2d7a41b6
+Create Date: 2026-10-17 11:40:08.512677
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a1e5c0b92d4'
+down_revision = '3f9c2d7a41b6'
+branch_labels = None
+depends_on = None
+
+
+OWNERS = (('venues', 'venue_id'), ('artists', 'artist_id'))
+
+
+def upgrade():
+    for table, owner in OWNERS:
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('next_show_time', sa.DateTime(), nullable=True))
+        op.create_index(f'ix_{table}_next_show_time', table, ['next_show_time'], unique=False)
+
+        # backfill, same values as models.show_counter_values()
+        op.execute(f"""
+            UPDATE {table} SET
+                upcoming_shows_count = (
+                    SELECT count(*) FROM shows
+                    WHERE shows.{owner} = {table}.id AND shows.start_time > now()
+                ),
+                past_shows_count = (
+                    SELECT count(*) FROM shows
+                    WHERE shows.{owner} = {table}.id AND shows.start_time <= now()
+                ),
+                next_show_time = (
+                    SELECT min(shows.start_time) FROM shows
+                    WHERE shows.{owner} = {table}.id AND shows.start_time > now()
+                )
+        """)
+
+    op.create_index('ix_venues_area', 'venues', ['state', 'city', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_venues_area', table_name='venues')
+
+    for table, _ in OWNERS:
+        op.drop_index(f'ix_{table}_next_show_time', table_name=table)
+        op.drop_column(table, 'next_show_time')
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
@@ -0,0 +1,37 @@
+"""add venue coordinates and a gist index for nearby search
+
+Revision ID: 9d3f61b7c2a5
+Revises: e2a94c6b1f07
+Create Date: 2026-10-17 21:37:12.081946
+
+Existing venues get their coordinates from `flask geocode-venues`.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3f61b7c2a5'
+down_revision = 'e2a94c6b1f07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS cube')
+    op.execute('CREATE EXTENSION IF NOT EXISTS earthdistance')
+
+    op.add_column('venues', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('venues', sa.Column('longitude', sa.Float(), nullable=True))
+    # same expression as geosearch.postgres_nearby_stmt(): serves earth_box
+    # radius filters and <-> nearest-first ordering
+    op.execute(
+        'CREATE INDEX ix_venues_location ON venues USING gist (ll_to_earth(latitude, longitude))'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_venues_location', table_name='venues')
+    op.drop_column('venues', 'longitude')
+    op.drop_column('venues', 'latitude')
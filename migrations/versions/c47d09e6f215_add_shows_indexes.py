@@ -0,0 +1,27 @@
+"""add indexes for the shows hot paths
+
+Revision ID: c47d09e6f215
+Revises: 8a1e5c0b92d4
+Create Date: 2026-10-17 13:05:52.730194
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47d09e6f215'
+down_revision = '8a1e5c0b92d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_start_time', 'shows', ['start_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shows_start_time', table_name='shows')
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
@@ -0,0 +1,57 @@
+"""add show end times and exclusion constraints against double booking
+
+Revision ID: e2a94c6b1f07
+Revises: 5b7e2f4c8d13
+Create Date: 2026-10-17 20:48:31.604215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a94c6b1f07'
+down_revision = '5b7e2f4c8d13'
+branch_labels = None
+depends_on = None
+
+
+# models.DEFAULT_SHOW_DURATION at the time of this migration
+DEFAULT_SHOW_DURATION = "interval '2 hours'"
+
+OWNERS = ('venue', 'artist')
+
+
+def upgrade():
+    # lets a gist index combine the integer equality with the range overlap
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+
+    op.add_column('shows', sa.Column('end_time', sa.DateTime(), nullable=True))
+    op.execute(f'UPDATE shows SET end_time = start_time + {DEFAULT_SHOW_DURATION}')
+    op.alter_column('shows', 'end_time', existing_type=sa.DateTime(), nullable=False)
+    op.create_check_constraint('ck_shows_end_after_start', 'shows', 'end_time > start_time')
+
+    connection = op.get_bind()
+    for owner in OWNERS:
+        overlapping = connection.execute(sa.text(f"""
+            SELECT count(*) FROM shows a JOIN shows b
+              ON a.{owner}_id = b.{owner}_id AND a.id < b.id
+             AND tsrange(a.start_time, a.end_time) && tsrange(b.start_time, b.end_time)
+        """)).scalar()
+        if overlapping:
+            raise RuntimeError(
+                f'{overlapping} pairs of shows overlap at the same {owner}; '
+                'move or delete them before upgrading.'
+            )
+
+        op.execute(f"""
+            ALTER TABLE shows ADD CONSTRAINT ex_shows_{owner}_overlap
+            EXCLUDE USING gist ({owner}_id WITH =, tsrange(start_time, end_time) WITH &&)
+        """)
+
+
+def downgrade():
+    for owner in OWNERS:
+        op.drop_constraint(f'ex_shows_{owner}_overlap', 'shows')
+    op.drop_constraint('ck_shows_end_after_start', 'shows', type_='check')
+    op.drop_column('shows', 'end_time')
@@ -1,6 +1,236 @@
-from datetime import datetime
-from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy()
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+from time import perf_counter, monotonic, time
+from flask import current_app, g, request, has_request_context, session as client_session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import select, update, func, inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+#----------------------------------------------------------------------------#
+# Database.
+#----------------------------------------------------------------------------#
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class TimedQueuePool(QueuePool):
+  # QueuePool that also accounts for the time spent waiting on a connection
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.waits = 0
+    self.wait_seconds = 0.0
+
+  def _do_get(self):
+    start = perf_counter()
+    try:
+      return super()._do_get()
+    finally:
+      self.waits += 1
+      self.wait_seconds += perf_counter() - start
+
+
+class ReplicaRouter:
+  # picks the replica bind for a read with smooth weighted round-robin,
+  # skipping replicas whose replication lag is over REPLICA_MAX_LAG_SECONDS.
+  # lag is probed at most every REPLICA_LAG_CHECK_SECONDS per replica, in a
+  # background thread: reads only see the last probe, so an unreachable
+  # replica never holds them up for its connect timeout.
+
+  def __init__(self):
+    self.lock = Lock()
+    self.replicas = []
+
+  def configure(self, binds, weights):
+    if len(binds) != len(weights):
+      raise RuntimeError(f'{len(binds)} replica URLs but {len(weights)} replica weights.')
+    self.replicas = [
+      # a replica counts as lagging until its first probe answers
+      {'bind': bind, 'weight': weight, 'current': 0, 'lag': float('inf'), 'checked_at': None, 'probing': False}
+      for bind, weight in zip(binds, weights)
+    ]
+
+  def replica_lag(self, app, bind):
+    engine = db.get_engine(app, bind=bind)
+    if engine.dialect.name != 'postgresql':
+      return 0.0
+
+    with engine.connect() as connection:
+      return connection.exec_driver_sql("""
+        SELECT CASE WHEN pg_is_in_recovery()
+          THEN coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+          ELSE 0 END
+      """).scalar()
+
+  def probe(self, app, replica):
+    # runs in its own thread, which needs an app context for the engine and
+    # the query instrumentation
+    with app.app_context():
+      try:
+        lag = self.replica_lag(app, replica['bind'])
+      except Exception:
+        app.logger.warning('replica %s unreachable, reading from primary', replica['bind'])
+        lag = float('inf')
+
+    with self.lock:
+      replica['lag'] = lag
+      replica['probing'] = False
+
+  def refresh(self, app):
+    # probes every replica now, in this thread (see flask check-replicas)
+    for replica in self.replicas:
+      replica['checked_at'] = monotonic()
+      self.probe(app, replica)
+
+  def healthy(self, app, replica):
+    # called with the lock held: starts a probe when one is due, never waits
+    now = monotonic()
+    due = replica['checked_at'] is None or now - replica['checked_at'] >= app.config['REPLICA_LAG_CHECK_SECONDS']
+    if due and not replica['probing']:
+      replica['checked_at'] = now
+      replica['probing'] = True
+      Thread(target=self.probe, args=(app, replica), daemon=True).start()
+
+    return replica['lag'] <= app.config['REPLICA_MAX_LAG_SECONDS']
+
+  def choose(self, app):
+    with self.lock:
+      candidates = [replica for replica in self.replicas if self.healthy(app, replica)]
+      if not candidates:
+        return None
+
+      total = sum(replica['weight'] for replica in candidates)
+      for replica in candidates:
+        replica['current'] += replica['weight']
+      chosen = max(candidates, key=lambda replica: replica['current'])
+      chosen['current'] -= total
+      return chosen['bind']
+
+
+router = ReplicaRouter()
+
+
+def reads_from_replica():
+  # GET requests read from a replica, unless this client wrote recently and
+  # has to see its own writes (see stick_to_primary)
+  return (
+    has_request_context()
+    and request.method in READ_METHODS
+    and client_session.get('primary_until', 0) < time()
+  )
+
+
+class RoutingSession(SignallingSession):
+  # flushes, writes and non-GET requests always use the primary. a request
+  # sticks to the replica chosen for its first read.
+
+  def get_bind(self, mapper=None, clause=None, **kwargs):
+    if (
+      router.replicas
+      and not self._flushing
+      and (clause is None or getattr(clause, 'is_select', False))
+      and reads_from_replica()
+    ):
+      if 'read_bind' not in g:
+        g.read_bind = router.choose(self.app)
+      if g.read_bind is not None:
+        return db.get_engine(self.app, bind=g.read_bind)
+
+    return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+  def create_session(self, options):
+    return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+@db.event.listens_for(RoutingSession, 'after_flush')
+def mark_primary_write(session, flush_context):
+  if has_request_context():
+    g.wrote_primary = True
+
+
+def configure_db(app):
+  # engine settings come from DB_* config values, see config.py
+  config = app.config
+  options = config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+  url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+
+  if url.get_backend_name() != 'sqlite':
+    options.setdefault('poolclass', TimedQueuePool)
+    options.setdefault('pool_size', config['DB_POOL_SIZE'])
+    options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+    options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+    options.setdefault('pool_pre_ping', config['DB_POOL_PRE_PING'])
+
+  if url.get_backend_name() == 'postgresql' and config['DB_STATEMENT_TIMEOUT_MS']:
+    connect_args = options.setdefault('connect_args', {})
+    connect_args.setdefault('options', f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}")
+
+  binds = config.get('SQLALCHEMY_BINDS') or {}
+  replica_binds = []
+  for i, uri in enumerate(config['SQLALCHEMY_REPLICA_URIS']):
+    binds[f'replica_{i}'] = uri
+    replica_binds.append(f'replica_{i}')
+  config['SQLALCHEMY_BINDS'] = binds
+
+  weights = config['SQLALCHEMY_REPLICA_WEIGHTS'] or [1] * len(replica_binds)
+  router.configure(replica_binds, weights)
+
+  db.init_app(app)
+
+  @app.after_request
+  def stick_to_primary(response):
+    # after a write, keep this client on the primary for a while so the
+    # redirect that follows (and the next few pages) see what it just wrote
+    if g.get('wrote_primary'):
+      client_session['primary_until'] = time() + config['PRIMARY_STICKY_SECONDS']
+    return response
+
+
+def pool_metrics():
+  # prometheus gauges for every engine's pool, for the /_metrics endpoint,
+  # grouped by family as the text format requires
+  pools = [
+    (f'bind="{bind or "primary"}"', db.get_engine(current_app, bind=bind).pool)
+    for bind in [None, *current_app.config['SQLALCHEMY_BINDS']]
+  ]
+  queued = [(label, pool) for label, pool in pools if isinstance(pool, QueuePool)]
+  timed = [(label, pool) for label, pool in pools if isinstance(pool, TimedQueuePool)]
+
+  return [
+    '# TYPE fyyur_db_pool_checked_out gauge',
+    *(f'fyyur_db_pool_checked_out{{{label}}} {pool.checkedout()}' for label, pool in queued),
+    '# TYPE fyyur_db_pool_overflow gauge',
+    *(f'fyyur_db_pool_overflow{{{label}}} {max(pool.overflow(), 0)}' for label, pool in queued),
+    '# TYPE fyyur_db_pool_waits_total counter',
+    *(f'fyyur_db_pool_waits_total{{{label}}} {pool.waits}' for label, pool in timed),
+    '# TYPE fyyur_db_pool_wait_seconds_total counter',
+    *(f'fyyur_db_pool_wait_seconds_total{{{label}}} {pool.wait_seconds:.6f}' for label, pool in timed),
+  ]
+
+
+# postgres arrays (the dialect type, for @> and GIN indexes), stored as JSON
+# when the app runs against SQLite in tests
+GenreList = postgresql.ARRAY(db.String()).with_variant(db.JSON(), 'sqlite')
+
+# shows listed without an end time are booked for this long
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+# and at most this long (checked by ShowForm), which bounds how far back a
+# calendar has to look for shows running into its month
+MAX_SHOW_DURATION = timedelta(days=7)
+
+
+def default_end_time(context):
+  return (context.get_current_parameters().get('start_time') or datetime.utcnow()) + DEFAULT_SHOW_DURATION
 
 #----------------------------------------------------------------------------#
 # Models.
@@ -14,11 +244,22 @@ db = SQLAlchemy()
 # )
 class Show(db.Model):
   __tablename__ = 'shows'
+  __table_args__ = (
+    # per-owner timelines and delete cascades, then the global shows feed
+    db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_shows_start_time', 'start_time', 'id'),
+    db.CheckConstraint('end_time > start_time', name='ck_shows_end_after_start'),
+    # on postgres, the add_show_end_times migration also adds gist exclusion
+    # constraints: no two shows of a venue, or of an artist, overlap.
+    # scheduling.py runs the same check ahead of inserts.
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'), nullable=False)
   artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'), nullable=False)
   start_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+  end_time = db.Column(db.DateTime, nullable=False, default=default_end_time)
 
   def __repr__(self):
     return f'<Show {self.id} {self.start_time}>'
@@ -26,10 +267,16 @@ class Show(db.Model):
 
 class Venue(db.Model):
     __tablename__ = 'venues'
+    __table_args__ = (
+      # directory listing order, see queries.venue_directory_stmt
+      db.Index('ix_venues_area', 'state', 'city', 'id'),
+      # genre facet filters (genres @> ARRAY[...]), see facets.py
+      db.Index('ix_venues_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(), nullable=False)
-    genres = db.Column(db.ARRAY(db.String()), nullable=False, default=[])
+    genres = db.Column(GenreList, nullable=False, default=[])
     address = db.Column(db.String(120), nullable=False)
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120), nullable=False)
@@ -39,8 +286,18 @@ class Venue(db.Model):
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(500))
     image_link = db.Column(db.String(500))
+    # geocoded offline from the address, see geosearch.fill_coordinates. on
+    # postgres, the add_venue_coordinates migration indexes them with gist.
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    shows = db.relationship('Show', backref=db.backref('venues', lazy=True), cascade='all, delete-orphan', lazy='subquery')
+    # maintained by the show counter events below, see refresh_show_counters
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_time = db.Column(db.DateTime, index=True)
+    # never loaded implicitly: views select the show columns they need, and
+    # anything else must ask for the collection with a loader option
+    shows = db.relationship('Show', backref=db.backref('venues', lazy='raise'), cascade='all, delete-orphan', lazy='raise')
 
     def __repr__(self):
       return f'<Venue {self.id} {self.name}>'
@@ -50,10 +307,14 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'artists'
+    __table_args__ = (
+      db.Index('ix_artists_area', 'state', 'city', 'id'),
+      db.Index('ix_artists_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(), nullable=False)
-    genres = db.Column(db.ARRAY(db.String()), nullable=False, default=[])
+    genres = db.Column(GenreList, nullable=False, default=[])
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120))
@@ -63,7 +324,12 @@ class Artist(db.Model):
     seeking_description = db.Column(db.String(500))
     image_link = db.Column(db.String(500))
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    shows = db.relationship('Show', backref=db.backref('artists', lazy=True), cascade='all, delete-orphan', lazy='subquery')
+    # maintained by the show counter events below, see refresh_show_counters
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_time = db.Column(db.DateTime, index=True)
+    # see Venue.shows
+    shows = db.relationship('Show', backref=db.backref('artists', lazy='raise'), cascade='all, delete-orphan', lazy='raise')
 
     def __repr__(self):
       return f'<Artist {self.id} {self.name}>'
@@ -72,3 +338,88 @@ class Artist(db.Model):
     # DONE: implement any missing fields, as a database migration using Flask-Migrate
 
 # DONE: Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
+
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+def show_counter_values(model, now):
+  # correlated subqueries recomputing a venue's/artist's counters from shows
+  owner = Show.venue_id if model is Venue else Show.artist_id
+  owned = owner == model.id
+
+  return {
+    'upcoming_shows_count': select(func.count(Show.id)).where(owned, Show.start_time > now).scalar_subquery(),
+    'past_shows_count': select(func.count(Show.id)).where(owned, Show.start_time <= now).scalar_subquery(),
+    'next_show_time': select(func.min(Show.start_time)).where(owned, Show.start_time > now).scalar_subquery()
+  }
+
+
+def refresh_show_counters(connection, model, ids=None, now=None):
+  # ids=None refreshes every row. returns the number of rows touched.
+  stmt = update(model.__table__).values(**show_counter_values(model, now or datetime.now()))
+
+  if ids is not None:
+    if not ids:
+      return 0
+    stmt = stmt.where(model.id.in_(ids))
+
+  return connection.execute(stmt.execution_options(synchronize_session=False)).rowcount
+
+
+def roll_over_show_counters(connection, now=None):
+  # shows only move from upcoming to past, so the rows due for a refresh are
+  # exactly those whose next show has started. served by ix_*_next_show_time.
+  now = now or datetime.now()
+  total = 0
+
+  for model in (Venue, Artist):
+    due = select(model.id).where(model.next_show_time <= now).scalar_subquery()
+    stmt = update(model.__table__).where(model.id.in_(due)).values(**show_counter_values(model, now))
+    total += connection.execute(stmt).rowcount
+
+  return total
+
+
+def stale_show_counters(connection, model, now=None):
+  # rows whose stored counters disagree with the shows table
+  values = show_counter_values(model, now or datetime.now())
+
+  return connection.execute(
+    select(model.id, model.upcoming_shows_count, model.past_shows_count, model.next_show_time)
+    .where(
+      (model.upcoming_shows_count != values['upcoming_shows_count']) |
+      (model.past_shows_count != values['past_shows_count']) |
+      (func.coalesce(model.next_show_time, datetime.min) != func.coalesce(values['next_show_time'], datetime.min))
+    )
+  ).all()
+
+
+def touched_show_owners(session):
+  venue_ids, artist_ids = set(), set()
+
+  for show in (*session.new, *session.dirty, *session.deleted):
+    if not isinstance(show, Show):
+      continue
+
+    state = inspect(show)
+    venue_ids.update(
+      id for id in (show.venue_id, *state.attrs.venue_id.history.deleted) if id is not None
+    )
+    artist_ids.update(
+      id for id in (show.artist_id, *state.attrs.artist_id.history.deleted) if id is not None
+    )
+
+  return venue_ids, artist_ids
+
+
+@db.event.listens_for(Session, 'after_flush')
+def update_show_counters(session, flush_context):
+  venue_ids, artist_ids = touched_show_owners(session)
+
+  if venue_ids or artist_ids:
+    connection = session.connection()
+    now = datetime.now()
+    refresh_show_counters(connection, Venue, venue_ids, now)
+    refresh_show_counters(connection, Artist, artist_ids, now)
@@ -0,0 +1,57 @@
+from collections import namedtuple
+from sqlalchemy import select
+from models import db, Venue, Artist
+
+#----------------------------------------------------------------------------#
+# Row projections.
+#----------------------------------------------------------------------------#
+
+def projection(typename, **columns):
+  # a compact row type for views that read a handful of columns:
+  #
+  #   ArtistListing = projection('ArtistListing', id=Artist.id, name=Artist.name)
+  #   artists = fetch_projected(ArtistListing, projected(ArtistListing).order_by(Artist.id))
+  #
+  # instances are plain tuples with named fields (no __dict__, no identity
+  # map entry or instance state, unlike ORM objects), which templates read as
+  # attributes and the API turns into JSON with _asdict().
+  row = namedtuple(typename, columns)
+  row.columns = columns
+  return row
+
+
+def projected(row, *extra):
+  # a column-only select of the projection's columns, then any extra columns
+  # (e.g. a window count) which project() leaves out
+  return select(*(column.label(field) for field, column in row.columns.items()), *extra)
+
+
+def project(row, rows):
+  width = len(row._fields)
+  return [row._make(values[:width]) for values in rows]
+
+
+def fetch_projected(row, stmt):
+  return project(row, db.session.execute(stmt))
+
+
+#  List views
+#  ----------------------------------------------------------------
+
+VenueListing = projection(
+  'VenueListing',
+  id=Venue.id,
+  name=Venue.name,
+  city=Venue.city,
+  state=Venue.state,
+  num_upcoming_shows=Venue.upcoming_shows_count
+)
+
+ArtistListing = projection('ArtistListing', id=Artist.id, name=Artist.name)
+
+SEARCH_HITS = {
+  model: projection(
+    f'{model.__name__}Hit', id=model.id, name=model.name, num_upcoming_shows=model.upcoming_shows_count
+  )
+  for model in (Venue, Artist)
+}
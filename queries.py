@@ -0,0 +1,198 @@
+from datetime import datetime
+from itertools import groupby
+from sqlalchemy import select, func, case, tuple_
+from models import db, Venue, Artist, Show
+from facets import apply_facets
+from projections import VenueListing, ArtistListing, projected, project, fetch_projected
+
+#----------------------------------------------------------------------------#
+# Venue directory.
+#----------------------------------------------------------------------------#
+
+VENUES_PER_PAGE = 100
+
+
+def venue_directory_stmt(page=1, per_page=VENUES_PER_PAGE, filters=None):
+  # venues ordered by area, read together with their maintained upcoming
+  # show counter, so a page is a single scan of ix_venues_area. one extra
+  # row is fetched so the caller knows whether a next page exists.
+  stmt = (
+    projected(VenueListing)
+    .order_by(Venue.state, Venue.city, Venue.id)
+    .limit(per_page + 1)
+    .offset((page - 1) * per_page)
+  )
+  return apply_facets(stmt, Venue, filters)
+
+
+def group_areas(rows):
+  # rows arrive sorted by (state, city), so grouping is a single linear pass
+  areas = []
+
+  for (state, city), venues in groupby(rows, key=lambda row: (row.state, row.city)):
+    areas.append({'city': city, 'state': state, 'venues': list(venues)})
+
+  return areas
+
+
+def venue_directory_page(rows, page, per_page=VENUES_PER_PAGE):
+  has_next = len(rows) > per_page
+
+  return {
+    'areas': group_areas(project(VenueListing, rows[:per_page])),
+    'page': page,
+    'has_prev': page > 1,
+    'has_next': has_next
+  }
+
+
+def venue_directory(page=1, per_page=VENUES_PER_PAGE, filters=None):
+  rows = db.session.execute(venue_directory_stmt(page, per_page, filters)).all()
+  return venue_directory_page(rows, page, per_page)
+
+
+#----------------------------------------------------------------------------#
+# Artist directory.
+#----------------------------------------------------------------------------#
+
+def artist_directory_stmt(filters=None):
+  return apply_facets(projected(ArtistListing).order_by(Artist.id), Artist, filters)
+
+
+def artist_directory(filters=None):
+  return fetch_projected(ArtistListing, artist_directory_stmt(filters))
+
+
+#----------------------------------------------------------------------------#
+# Show timeline.
+#----------------------------------------------------------------------------#
+
+PROFILE_SHOWS_LIMIT = 50
+
+def show_timeline_stmt(id, search, past_limit=None, upcoming_limit=None, now=None):
+  # past and upcoming shows of one venue/artist in a single statement. rows are
+  # numbered and counted per side with window functions, so the per-side
+  # limits are applied in the database while the totals stay exact.
+  now = now or datetime.now()
+  owner = Show.venue_id if search == 'venue' else Show.artist_id
+  is_upcoming = case((Show.start_time > now, True), else_=False)
+
+  shows = (
+    select(
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Venue.image_link.label('venue_image_link'),
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link'),
+      Show.start_time,
+      is_upcoming.label('is_upcoming'),
+      func.row_number().over(
+        partition_by=is_upcoming,
+        # upcoming shows soonest first, past shows most recent first
+        order_by=(case((Show.start_time > now, Show.start_time)).asc(), Show.start_time.desc())
+      ).label('position'),
+      func.count().over(partition_by=is_upcoming).label('total')
+    )
+    .join(Venue, Venue.id == Show.venue_id)
+    .join(Artist, Artist.id == Show.artist_id)
+    .where(owner == id)
+  ).subquery()
+
+  stmt = select(shows).order_by(shows.c.is_upcoming, shows.c.position)
+
+  if past_limit is not None:
+    stmt = stmt.where(shows.c.is_upcoming | (shows.c.position <= past_limit))
+  if upcoming_limit is not None:
+    stmt = stmt.where(~shows.c.is_upcoming | (shows.c.position <= upcoming_limit))
+
+  return stmt
+
+
+def partition_timeline(rows):
+  timeline = {
+    'past_shows': [],
+    'upcoming_shows': [],
+    'past_shows_count': 0,
+    'upcoming_shows_count': 0
+  }
+
+  for row in rows:
+    side = 'upcoming' if row.is_upcoming else 'past'
+    timeline[side + '_shows_count'] = row.total
+    timeline[side + '_shows'].append({
+      'venue_id': row.venue_id,
+      'venue_name': row.venue_name,
+      'venue_image_link': row.venue_image_link,
+      'artist_id': row.artist_id,
+      'artist_name': row.artist_name,
+      'artist_image_link': row.artist_image_link,
+      'start_time': row.start_time
+    })
+
+  return timeline
+
+
+def show_timeline(id, search, past_limit=None, upcoming_limit=None):
+  stmt = show_timeline_stmt(id, search, past_limit, upcoming_limit)
+  return partition_timeline(db.session.execute(stmt))
+
+
+#----------------------------------------------------------------------------#
+# Shows feed.
+#----------------------------------------------------------------------------#
+
+SHOWS_PER_PAGE = 60
+
+
+def encode_cursor(start_time, id):
+  return f'{start_time.isoformat()}_{id}'
+
+
+def decode_cursor(cursor):
+  try:
+    start_time, id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(start_time), int(id)
+  except (AttributeError, ValueError):
+    return None
+
+
+def shows_feed_stmt(after=None, per_page=SHOWS_PER_PAGE):
+  # keyset pagination on (start_time, id): each page seeks straight to the
+  # cursor instead of counting past an OFFSET, so deep pages cost the same as
+  # the first one. only the columns the feed renders are selected.
+  stmt = (
+    select(
+      Show.id,
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link'),
+      Show.start_time
+    )
+    .join(Venue, Venue.id == Show.venue_id)
+    .join(Artist, Artist.id == Show.artist_id)
+    .order_by(Show.start_time, Show.id)
+    .limit(per_page + 1)
+  )
+
+  if after is not None:
+    stmt = stmt.where(tuple_(Show.start_time, Show.id) > tuple_(*after))
+
+  return stmt
+
+
+def shows_feed_page(rows, per_page=SHOWS_PER_PAGE):
+  next_cursor = None
+
+  if len(rows) > per_page:
+    rows = rows[:per_page]
+    next_cursor = encode_cursor(rows[-1].start_time, rows[-1].id)
+
+  return {'shows': rows, 'next_cursor': next_cursor}
+
+
+def shows_feed(cursor=None, per_page=SHOWS_PER_PAGE):
+  rows = db.session.execute(shows_feed_stmt(decode_cursor(cursor), per_page)).all()
+  return shows_feed_page(rows, per_page)
@@ -0,0 +1,227 @@
+import calendar
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, func, and_, literal, literal_column, union_all, DateTime, Integer
+from models import db, Venue, Artist, Show, DEFAULT_SHOW_DURATION, MAX_SHOW_DURATION
+from projections import projection
+
+#----------------------------------------------------------------------------#
+# Double-booking checks.
+#----------------------------------------------------------------------------#
+
+# slots per availability request, and per statement of a larger check:
+# sqlite refuses compound selects of more than 500 terms
+AVAILABILITY_MAX_SLOTS = 500
+
+ShowBooking = projection(
+  'ShowBooking',
+  show_id=Show.id,
+  venue_id=Show.venue_id,
+  artist_id=Show.artist_id,
+  start_time=Show.start_time,
+  end_time=Show.end_time
+)
+
+
+def with_end_time(values):
+  # shows listed without an end time get the default duration
+  if not values.get('end_time'):
+    values['end_time'] = values['start_time'] + DEFAULT_SHOW_DURATION
+  return values
+
+
+def overlaps(start_time, end_time):
+  # shows are half-open ranges: one may start when the previous one ends. on
+  # postgres this is the && of the exclusion constraints, so the check is
+  # served by their gist indexes.
+  if db.engine.dialect.name == 'postgresql':
+    return func.tsrange(Show.start_time, Show.end_time).op('&&')(func.tsrange(start_time, end_time))
+  return and_(Show.start_time < end_time, Show.end_time > start_time)
+
+
+def slots_cte(slots):
+  # the candidate slots as literal rows, numbered by their position
+  rows = [
+    select(
+      literal(i, Integer).label('slot'),
+      literal(slot['venue_id'], Integer).label('venue_id'),
+      literal(slot['artist_id'], Integer).label('artist_id'),
+      literal(slot['start_time'], DateTime).label('start_time'),
+      literal(slot['end_time'], DateTime).label('end_time')
+    )
+    for i, slot in enumerate(slots)
+  ]
+  return (union_all(*rows) if len(rows) > 1 else rows[0]).cte('slots')
+
+
+def conflicts_stmt(slots):
+  # every existing show a slot would overlap, at its venue or with its
+  # artist, in one statement: one indexed join per side
+  candidates = slots_cte(slots)
+
+  def side(owner):
+    column = getattr(Show, f'{owner}_id')
+    return (
+      select(candidates.c.slot, literal_column(f"'{owner}'").label('owner'), *ShowBooking.columns.values())
+      .join_from(candidates, Show, and_(
+        column == candidates.c[f'{owner}_id'],
+        overlaps(candidates.c.start_time, candidates.c.end_time)
+      ))
+    )
+
+  return union_all(side('venue'), side('artist'))
+
+
+def availability(slots):
+  # slots: [{'venue_id', 'artist_id', 'start_time', 'end_time'}]. returns,
+  # in the same order, {'available': bool, 'conflicts': [{'with', ...}]}
+  results = [{'available': True, 'conflicts': []} for _ in slots]
+
+  for offset in range(0, len(slots), AVAILABILITY_MAX_SLOTS):
+    for row in db.session.execute(conflicts_stmt(slots[offset:offset + AVAILABILITY_MAX_SLOTS])):
+      result = results[offset + row.slot]
+      result['available'] = False
+      result['conflicts'].append({'with': row.owner, **ShowBooking._make(row[2:])._asdict()})
+
+  for result in results:
+    result['conflicts'].sort(key=lambda conflict: (conflict['start_time'], conflict['show_id']))
+
+  return results
+
+
+def batch_conflicts(slots):
+  # the same check among slots not yet stored, e.g. one import chunk: taken
+  # by start time, a slot is refused when it overlaps one accepted before it
+  # at its venue or with its artist. returns, in the same order, None or
+  # (position of that slot, 'venue' or 'artist').
+  results = [None] * len(slots)
+  busy_until = {}  # (owner, id): (end_time, position) of the latest accepted end
+
+  for i in sorted(range(len(slots)), key=lambda i: (slots[i]['start_time'], i)):
+    slot = slots[i]
+    for owner in ('venue', 'artist'):
+      busy = busy_until.get((owner, slot[f'{owner}_id']))
+      if busy and busy[0] > slot['start_time']:
+        results[i] = (busy[1], owner)
+        break
+    else:
+      for owner in ('venue', 'artist'):
+        key = (owner, slot[f'{owner}_id'])
+        if key not in busy_until or busy_until[key][0] < slot['end_time']:
+          busy_until[key] = (slot['end_time'], i)
+
+  return results
+
+
+def show_conflicts(venue_id, artist_id, start_time, end_time):
+  slot = {'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start_time, 'end_time': end_time}
+  return availability([slot])[0]['conflicts']
+
+
+def describe_conflict(conflict):
+  owner = f"venue {conflict['venue_id']}" if conflict['with'] == 'venue' else f"artist {conflict['artist_id']}"
+  return (
+    f"The {owner} already has show {conflict['show_id']} from "
+    f"{conflict['start_time']:%Y-%m-%d %H:%M} to {conflict['end_time']:%Y-%m-%d %H:%M}."
+  )
+
+
+#----------------------------------------------------------------------------#
+# Availability calendars.
+#----------------------------------------------------------------------------#
+
+# months outside these years are refused rather than overflowing datetime
+CALENDAR_YEARS = (1900, 2999)
+
+DAY = timedelta(days=1)
+
+
+def parse_month(month):
+  # 'YYYY-MM' (the current month when empty) -> the month's first day, or
+  # None when malformed or out of range
+  if not month:
+    return date.today().replace(day=1)
+  try:
+    first = datetime.strptime(month, '%Y-%m').date()
+  except ValueError:
+    return None
+  return first if CALENDAR_YEARS[0] <= first.year <= CALENDAR_YEARS[1] else None
+
+
+def calendar_stmt(owner, id, range_start, range_end):
+  # the owner's shows overlapping [range_start, range_end), with the other
+  # party's name. no show runs longer than MAX_SHOW_DURATION, so a bounded
+  # scan of ix_shows_<owner>_id_start_time finds them all: its cost follows
+  # the range, not the owner's history.
+  other = Artist if owner == 'venue' else Venue
+  other_id = getattr(Show, f'{other.__tablename__[:-1]}_id')
+
+  return (
+    select(Show.id, Show.start_time, Show.end_time, other_id.label('other_id'), other.name.label('other_name'))
+    .join(other, other.id == other_id)
+    .where(
+      getattr(Show, f'{owner}_id') == id,
+      Show.start_time >= range_start - MAX_SHOW_DURATION,
+      Show.start_time < range_end,
+      Show.end_time > range_start
+    )
+    .order_by(Show.start_time, Show.id)
+  )
+
+
+def calendar_tags(owner, id, calendar):
+  # page cache tags of a calendar: its owner and the other party of every
+  # show on it, whose names it lists
+  other = 'artist' if owner == 'venue' else 'venue'
+  return {f'{owner}:{id}'} | {
+    f"{other}:{show[other + '_id']}" for day in calendar['days'] for show in day['shows']
+  }
+
+
+def month_calendar(owner, id, month):
+  # one bucket per day of the month: its shows and the booked and free
+  # stretches of the day (shows crossing midnight count on both days)
+  first = datetime.combine(month, datetime.min.time())
+  days = calendar.monthrange(month.year, month.month)[1]
+  rows = db.session.execute(calendar_stmt(owner, id, first, first + days * DAY)).all()
+  buckets = []
+
+  for day in range(days):
+    day_start = first + day * DAY
+    day_end = day_start + DAY
+    shows = [row for row in rows if row.start_time < day_end and row.end_time > day_start]
+    booked, free, cursor = timedelta(), [], day_start
+
+    for show in shows:
+      start, end = max(show.start_time, day_start), min(show.end_time, day_end)
+      if start > cursor:
+        free.append((cursor, start))
+      booked += end - start
+      cursor = max(cursor, end)
+    if cursor < day_end:
+      free.append((cursor, day_end))
+
+    buckets.append({
+      'date': day_start.date(),
+      'booked_minutes': int(booked.total_seconds() // 60),
+      'free': free,
+      'shows': [{
+        'id': show.id,
+        f"{'artist' if owner == 'venue' else 'venue'}_id": show.other_id,
+        'name': show.other_name,
+        'start_time': show.start_time,
+        'end_time': show.end_time,
+      } for show in shows],
+    })
+
+  previous = (first - DAY).date().replace(day=1)
+  return {
+    'month': month,
+    'previous': previous,
+    'next': (first + days * DAY).date(),
+    'days': buckets,
+    # Monday-first weeks for the HTML grid, None outside the month
+    'weeks': [
+      [buckets[day - 1] if day else None for day in week]
+      for week in calendar.monthcalendar(month.year, month.month)
+    ],
+  }
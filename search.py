@@ -0,0 +1,170 @@
+import re
+from collections import defaultdict
+from threading import Lock
+from sqlalchemy import select, func, or_, literal, literal_column
+from models import db, Venue, Artist
+from facets import filtering, apply_facets
+from projections import SEARCH_HITS, projected, project
+
+#----------------------------------------------------------------------------#
+# Catalog search.
+#----------------------------------------------------------------------------#
+
+SEARCH_RESULTS_LIMIT = 100
+SIMILARITY_THRESHOLD = 0.6
+
+WORD_RE = re.compile(r'\w+')
+LIKE_SPECIAL_RE = re.compile(r'([\\%_])')
+
+
+def search_document(model):
+  # must stay in sync with the trigram expression indexes created by the
+  # add_search_indexes migration, otherwise postgres will not use them
+  space = literal_column("' '")
+  return (model.name + space + model.city + space + model.state).self_group()
+
+
+def contains_pattern(term):
+  # a LIKE pattern matching term literally: '100%' must not match everything
+  return '%' + LIKE_SPECIAL_RE.sub(r'\\\1', term) + '%'
+
+
+def postgres_search_stmt(model, term, limit, filters=None):
+  # full-text match on the generated tsvector column, plus substring and
+  # typo-tolerant trigram matches served by the gin_trgm_ops index. ranking,
+  # total count and upcoming show counters all come out of this one statement.
+  document = search_document(model)
+  vector = literal_column(f'{model.__tablename__}.search_vector')
+  query = func.websearch_to_tsquery('simple', term)
+
+  stmt = (
+    projected(SEARCH_HITS[model], func.count().over().label('total'))
+    .where(or_(
+      vector.op('@@')(query),
+      document.ilike(contains_pattern(term), escape='\\'),
+      literal(term).op('<%')(document)
+    ))
+    .order_by(
+      (func.ts_rank(vector, query) + func.word_similarity(term, document)).desc(),
+      model.name
+    )
+    .limit(limit)
+  )
+  return apply_facets(stmt, model, filters)
+
+
+def postgres_search(model, term, limit, filters=None):
+  rows = db.session.execute(postgres_search_stmt(model, term, limit, filters)).all()
+  return rows, rows[0].total if rows else 0
+
+
+#  In-process index
+#  ----------------------------------------------------------------
+#  SQLite has neither tsvector nor pg_trgm, so tests fall back to a trigram
+#  index held in memory. it is rebuilt lazily after any venue/artist write.
+
+def trigrams(text):
+  grams = set()
+
+  for word in WORD_RE.findall(text.lower()):
+    padded = f'  {word} '
+    grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+
+  return grams
+
+
+class TrigramIndex:
+
+  def __init__(self, model):
+    self.model = model
+    self.stale = True
+    self.lock = Lock()
+    self.documents = {}
+    self.postings = defaultdict(set)
+
+  def rebuild(self):
+    documents = {}
+    postings = defaultdict(set)
+    rows = db.session.execute(
+      select(self.model.id, self.model.name, self.model.city, self.model.state)
+    )
+
+    for id, name, city, state in rows:
+      text = f'{name} {city} {state}'
+      documents[id] = (name, text.lower())
+      for gram in trigrams(text):
+        postings[gram].add(id)
+
+    self.documents, self.postings = documents, postings
+    self.stale = False
+
+  def search(self, term):
+    with self.lock:
+      if self.stale:
+        self.rebuild()
+
+    needle = term.lower().strip()
+    needle_grams = trigrams(needle)
+
+    # substring matches on terms shorter than a trigram can't be found
+    # through the postings, so those scan the (small) test catalog
+    if len(needle) < 3:
+      candidates = self.documents.keys()
+    else:
+      candidates = set().union(*(self.postings.get(g, ()) for g in needle_grams))
+
+    matches = []
+
+    for id in candidates:
+      name, text = self.documents[id]
+      if needle in text:
+        score = 2.0
+      else:
+        score = len(needle_grams & trigrams(text)) / len(needle_grams)
+        if score < SIMILARITY_THRESHOLD:
+          continue
+      matches.append((-score, name, id))
+
+    matches.sort()
+    return [id for _, _, id in matches]
+
+
+indexes = {Venue: TrigramIndex(Venue), Artist: TrigramIndex(Artist)}
+
+
+def mark_stale(mapper, connection, target):
+  indexes[type(target)].stale = True
+
+
+for indexed in indexes:
+  for event in ('after_insert', 'after_update', 'after_delete'):
+    db.event.listen(indexed, event, mark_stale)
+
+
+def in_process_search(model, term, limit, filters=None):
+  ids = indexes[model].search(term)
+  if ids and filtering(filters):
+    matching = set(db.session.scalars(apply_facets(select(model.id).where(model.id.in_(ids)), model, filters)))
+    ids = [id for id in ids if id in matching]
+  page = ids[:limit]
+
+  if not page:
+    return [], len(ids)
+
+  rows = db.session.execute(projected(SEARCH_HITS[model]).where(model.id.in_(page))).all()
+  order = {id: position for position, id in enumerate(page)}
+
+  return sorted(rows, key=lambda row: order[row.id]), len(ids)
+
+
+def search_results(model, rows, count):
+  return {'count': count, 'data': project(SEARCH_HITS[model], rows)}
+
+
+def search_catalog(model, term, limit=SEARCH_RESULTS_LIMIT, filters=None):
+  if db.engine.dialect.name == 'postgresql':
+    rows, count = postgres_search(model, term, limit, filters)
+  else:
+    rows, count = in_process_search(model, term, limit, filters)
+
+  return search_results(model, rows, count)
@@ -0,0 +1,82 @@
+import os
+from time import perf_counter
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from cache import page_cache
+
+#----------------------------------------------------------------------------#
+# Template compilation.
+#----------------------------------------------------------------------------#
+
+def init_templates(app):
+  # compiled templates are kept as bytecode on disk, so a fresh worker loads
+  # them instead of parsing every template again (see flask warm-templates)
+  config = app.config
+  env = app.jinja_env
+
+  if config['TEMPLATE_BYTECODE_CACHE_DIR']:
+    os.makedirs(config['TEMPLATE_BYTECODE_CACHE_DIR'], exist_ok=True)
+    env.bytecode_cache = FileSystemBytecodeCache(config['TEMPLATE_BYTECODE_CACHE_DIR'])
+
+  env.add_extension(FragmentCacheExtension)
+  env.fragment_cache_ttl = config['FRAGMENT_CACHE_TTL']
+
+  if config['TEMPLATES_PRELOAD']:
+    warm_templates(app)
+
+
+def warm_templates(app):
+  # compiles (or loads from the bytecode cache) every template into the
+  # environment's in-memory cache. returns (templates, seconds).
+  started = perf_counter()
+  names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+
+  for name in names:
+    app.jinja_env.get_template(name)
+
+  return len(names), perf_counter() - started
+
+
+#----------------------------------------------------------------------------#
+# Fragment cache.
+#----------------------------------------------------------------------------#
+
+class FragmentCacheExtension(Extension):
+  # {% cache 'artist', show.artist_id, show.start_time %}...{% endcache %}
+  #
+  # caches the rendered block in the page cache backend. the first two
+  # arguments name the entity the fragment shows, and the entry is tagged
+  # with it: page_cache.invalidate('artist:3') -- which every artist write
+  # already does -- moves the artist to a new version and drops its fragments.
+  # the remaining arguments tell apart fragments of the same entity.
+
+  tags = {'cache'}
+
+  def __init__(self, environment):
+    super().__init__(environment)
+    environment.extend(fragment_cache_ttl=300)
+
+  def parse(self, parser):
+    lineno = next(parser.stream).lineno
+    args = [parser.parse_expression()]
+    while parser.stream.skip_if('comma'):
+      args.append(parser.parse_expression())
+
+    body = parser.parse_statements(['name:endcache'], drop_needle=True)
+    call = self.call_method('render_fragment', [nodes.Const(parser.name), nodes.List(args)])
+    return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+  def render_fragment(self, template_name, args, caller):
+    backend = page_cache.backend
+    if backend is None or len(args) < 2:
+      return caller()
+
+    key = 'fragment:' + ':'.join([template_name] + [str(arg) for arg in args])
+    fragment = backend.get(key)
+
+    if fragment is None:
+      fragment = str(caller())
+      backend.set(key, fragment, self.environment.fragment_cache_ttl, len(fragment), (f'{args[0]}:{args[1]}',))
+
+    return Markup(fragment)